@@ -0,0 +1,222 @@
+import asyncio
+import re
+import ssl
+from typing import Dict, List, Optional, Tuple
+
+from email_batch import EmailBatch
+from email_processor import HEADER_FETCH_ITEMS, EmailProcessor
+from imap_response import uid_set
+
+
+_LITERAL_RE = re.compile(rb'\{(\d+)\}$')
+_UNTAGGED_STATUS_RE = re.compile(rb'\* (\d+) ([A-Z-]+)(?: (.*))?$')
+_UNTAGGED_RE = re.compile(rb'\* ([A-Z-]+)(?: (.*))?$')
+_RESPONSE_CODE_RE = re.compile(rb'\[([A-Z-]+)(?: ([^\]]*))?\]')
+
+
+def _quote(value: str) -> str:
+    """Quote a string argument for an IMAP command"""
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+class AsyncIMAPConnection:
+    """Minimal asyncio IMAP4rev1 client speaking over an SSL stream
+
+    Untagged responses are collected the way imaplib does, so FETCH data can
+    be handed to the same parsers used by EmailProcessor.
+    """
+
+    def __init__(self):
+        self.reader = None
+        self.writer = None
+        self.capabilities = ()
+        self._tag = 0
+        self._lock = asyncio.Lock()
+
+    async def open(self, host: str, port: int = 993, ssl_context: Optional[ssl.SSLContext] = None):
+        """Open the connection and read the server greeting"""
+        self.reader, self.writer = await asyncio.open_connection(
+            host, port, ssl=ssl_context or ssl.create_default_context(), limit=2 ** 24
+        )
+        greeting = await self.reader.readline()
+        if not greeting.startswith((b'* OK', b'* PREAUTH')):
+            raise Exception(f"Unexpected greeting: {greeting!r}")
+
+        _, untagged = await self.command("CAPABILITY")
+        capability_data = untagged.get("CAPABILITY", [b""])[-1]
+        self.capabilities = tuple(capability_data.decode().upper().split())
+
+    async def command(self, name: str, *args: str) -> Tuple[str, Dict[str, List]]:
+        """Send a tagged command and collect untagged responses until it completes"""
+        async with self._lock:
+            self._tag += 1
+            tag = f"A{self._tag:05d}".encode()
+            line = b" ".join([tag, name.encode()] + [str(arg).encode() for arg in args])
+            self.writer.write(line + b"\r\n")
+            await self.writer.drain()
+
+            untagged = {}
+            while True:
+                line = (await self.reader.readline()).rstrip(b"\r\n")
+                if not line and self.reader.at_eof():
+                    raise Exception("Connection closed by server")
+
+                if line.startswith(tag + b" "):
+                    status = line[len(tag) + 1:].split(b" ", 1)[0].decode().upper()
+                    if status != "OK":
+                        raise Exception(f"{name} failed: {line.decode(errors='replace')}")
+                    return status, untagged
+
+                if line.startswith(b"* "):
+                    await self._read_untagged(line, untagged)
+
+    async def _read_untagged(self, line: bytes, untagged: Dict[str, List]):
+        """Read one untagged response, including any literals it carries"""
+        status_match = _UNTAGGED_STATUS_RE.match(line)
+        if status_match:
+            number, typ, rest = status_match.groups()
+            data = number + (b" " + rest if rest else b"")
+        else:
+            match = _UNTAGGED_RE.match(line)
+            if not match:
+                return
+            typ, data = match.group(1), match.group(2) or b""
+
+            code = _RESPONSE_CODE_RE.search(data)
+            if code:
+                untagged.setdefault(code.group(1).decode(), []).append(code.group(2) or b"")
+
+        entries = []
+        current = data
+        while True:
+            literal = _LITERAL_RE.search(current)
+            if not literal:
+                entries.append(current)
+                break
+            payload = await self.reader.readexactly(int(literal.group(1)))
+            entries.append((current, payload))
+            current = (await self.reader.readline()).rstrip(b"\r\n")
+
+        untagged.setdefault(typ.decode(), []).extend(entries)
+
+    async def close(self):
+        """Close the underlying stream"""
+        if self.writer:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except Exception:
+                pass
+
+
+class AsyncEmailProcessor:
+    """Process emails from IMAP on an asyncio event loop
+
+    Returns the same record dicts as EmailProcessor, so results can be passed
+    to ExcelExporter unchanged. Run several instances with asyncio.gather to
+    overlap I/O across accounts and folders.
+    """
+
+    def __init__(self):
+        self.connection = None
+        self.email_address = None
+        self.batch_size = 200
+        self.selected_folder = None
+        self._parser = EmailProcessor()
+
+    async def connect_imap(self, email_address: str, password: str,
+                           imap_server: str = "imap.gmail.com", port: int = 993) -> bool:
+        """Connect to email server using IMAP"""
+        try:
+            connection = AsyncIMAPConnection()
+            await connection.open(imap_server, port)
+            await connection.command("LOGIN", _quote(email_address), _quote(password))
+            self.connection = connection
+            self.email_address = email_address
+            self.selected_folder = None
+            return True
+        except Exception as e:
+            raise Exception(f"Failed to connect: {str(e)}")
+
+    async def get_folders(self) -> List[str]:
+        """Get list of available email folders"""
+        if not self.connection:
+            raise Exception("Not connected to email server")
+
+        try:
+            _, untagged = await self.connection.command("LIST", '""', '"*"')
+            folder_list = []
+            for folder in untagged.get("LIST", []):
+                if isinstance(folder, bytes) and '"' in folder.decode():
+                    folder_list.append(folder.decode().split('"')[-2])
+            return folder_list
+        except Exception as e:
+            raise Exception(f"Failed to get folders: {str(e)}")
+
+    async def search(self, folder: str = "INBOX", search_criteria: str = "ALL") -> List[bytes]:
+        """Return the UIDs in a folder matching the search criteria"""
+        if not self.connection:
+            raise Exception("Not connected to email server")
+
+        await self._select(folder)
+        _, untagged = await self.connection.command("UID", "SEARCH", search_criteria)
+        return b" ".join(untagged.get("SEARCH", [b""])).split()
+
+    async def fetch_emails(self, folder: str = "INBOX", limit: Optional[int] = None,
+                           search_criteria: str = "ALL", batch_size: Optional[int] = None,
+                           headers_only: bool = False) -> EmailBatch:
+        """Fetch emails from specified folder, batch_size messages per UID FETCH"""
+        batch_size = batch_size or self.batch_size
+
+        try:
+            email_ids = await self.search(folder, search_criteria)
+
+            if limit:
+                email_ids = email_ids[-limit:]
+
+            loop = asyncio.get_running_loop()
+            emails = EmailBatch()
+            for start in range(0, len(email_ids), batch_size):
+                batch = email_ids[start:start + batch_size]
+                if headers_only:
+                    _, untagged = await self.connection.command(
+                        "UID", "FETCH", uid_set(batch), HEADER_FETCH_ITEMS
+                    )
+                    emails.extend(await loop.run_in_executor(
+                        None, self._parser._parse_headers_response, untagged.get("FETCH", []), folder
+                    ))
+                    continue
+
+                _, untagged = await self.connection.command("UID", "FETCH", uid_set(batch), "(UID FLAGS BODY.PEEK[])")
+                emails.extend(await loop.run_in_executor(None, self._parse_batch, untagged.get("FETCH", []), folder))
+
+            return emails
+        except Exception as e:
+            raise Exception(f"Failed to fetch emails: {str(e)}")
+
+    def _parse_batch(self, msg_data: List, folder: str) -> List[Dict]:
+        """Parse a FETCH response of raw messages; run off the event loop"""
+        emails = []
+        for uid, raw_email, flags in self._parser._parse_raw_response(msg_data):
+            email_data = self._parser._parse_email(uid, raw_email, flags)
+            if email_data:
+                email_data["folder"] = folder
+                email_data["body_loaded"] = True
+                emails.append(email_data)
+        return emails
+
+    async def disconnect(self):
+        """Disconnect from email server"""
+        if self.connection:
+            try:
+                await self.connection.command("LOGOUT")
+            except Exception:
+                pass
+            await self.connection.close()
+            self.connection = None
+            self.selected_folder = None
+
+    async def _select(self, folder: str):
+        """Select a folder"""
+        await self.connection.command("SELECT", _quote(folder))
+        self.selected_folder = folder
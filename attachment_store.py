@@ -0,0 +1,202 @@
+import base64
+import hashlib
+import os
+import quopri
+import re
+import sqlite3
+import tempfile
+import threading
+from typing import Dict, Iterable, Optional
+
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+class _StreamDecoder:
+    """Incrementally decode a base64 or quoted-printable transfer encoding"""
+
+    def __init__(self, encoding: str):
+        self.encoding = (encoding or "").lower()
+        self._pending = b""
+
+    def decode(self, chunk: bytes) -> bytes:
+        """Decode as much of the data received so far as is complete"""
+        if self.encoding in ("base64", "base64url"):
+            data = self._pending + re.sub(rb'\s+', b'', chunk)
+            usable = len(data) // 4 * 4
+            self._pending = data[usable:]
+            return self._b64decode(data[:usable])
+
+        if self.encoding == "quoted-printable":
+            data = self._pending + chunk
+            cut = data.rfind(b"\n") + 1
+            self._pending = data[cut:]
+            return quopri.decodestring(data[:cut])
+
+        return chunk
+
+    def flush(self) -> bytes:
+        """Decode whatever is left at the end of the stream"""
+        remaining, self._pending = self._pending, b""
+        if not remaining:
+            return b""
+
+        if self.encoding in ("base64", "base64url"):
+            return self._b64decode(remaining + b"=" * (-len(remaining) % 4))
+        if self.encoding == "quoted-printable":
+            return quopri.decodestring(remaining)
+        return remaining
+
+    def _b64decode(self, data: bytes) -> bytes:
+        """Decode standard or URL-safe base64"""
+        if self.encoding == "base64url":
+            return base64.urlsafe_b64decode(data)
+        return base64.b64decode(data)
+
+
+class AttachmentStore:
+    """Deduplicated on-disk store of decoded attachments
+
+    Files are kept at objects/<aa>/<sha256>/<filename>, so identical content
+    is stored once whatever message it came from. The hash of the encoded
+    part is indexed too, and a part seen before is not decoded again.
+    """
+
+    def __init__(self, root: str = "attachments"):
+        self.root = root
+        self.stored = 0
+        self.duplicates = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        os.makedirs(os.path.join(root, "tmp"), exist_ok=True)
+
+        self._db = sqlite3.connect(os.path.join(root, "index.sqlite3"), check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS attachments (
+                sha256 TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                content_type TEXT
+            );
+            CREATE TABLE IF NOT EXISTS encoded (
+                encoded_sha256 TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL
+            );
+        """)
+        self._db.commit()
+
+    def save(self, chunks: Iterable[bytes], filename: str, encoding: str = "7bit",
+             content_type: str = "") -> str:
+        """Write an encoded attachment stream to disk and return its stored path
+
+        The encoded chunks are spooled to a temporary file, then decoded
+        chunk by chunk unless the same encoded part was stored before.
+        """
+        encoded_path, encoded_digest = self._spool(chunks)
+        try:
+            path = self._lookup_encoded(encoded_digest)
+            if path:
+                self.duplicates += 1
+                return path
+
+            decoded_path, digest, size = self._decode_file(encoded_path, encoding)
+            path = self._store(decoded_path, digest, filename)
+
+            with self._lock:
+                self._db.execute(
+                    "INSERT OR IGNORE INTO attachments (sha256, path, size, content_type) VALUES (?, ?, ?, ?)",
+                    (digest, path, size, content_type)
+                )
+                self._db.execute(
+                    "INSERT OR REPLACE INTO encoded (encoded_sha256, sha256) VALUES (?, ?)",
+                    (encoded_digest, digest)
+                )
+                self._db.commit()
+            return path
+        finally:
+            if os.path.exists(encoded_path):
+                os.remove(encoded_path)
+
+    def get_path(self, digest: str) -> Optional[str]:
+        """Return the stored path for a decoded content hash"""
+        with self._lock:
+            row = self._db.execute("SELECT path FROM attachments WHERE sha256 = ?", (digest,)).fetchone()
+        return row[0] if row and os.path.exists(row[0]) else None
+
+    def stats(self) -> Dict[str, int]:
+        """Return how many attachments were stored and how many were duplicates"""
+        return {"stored": self.stored, "duplicates": self.duplicates}
+
+    def close(self):
+        """Close the index database"""
+        with self._lock:
+            self._db.close()
+
+    def _spool(self, chunks: Iterable[bytes]) -> tuple:
+        """Write encoded chunks to a temporary file, hashing them on the way
+        
+        The file is removed if reading the chunks fails part way.
+        """
+        digest = hashlib.sha256()
+        fd, path = tempfile.mkstemp(dir=os.path.join(self.root, "tmp"))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    f.write(chunk)
+        except Exception:
+            os.remove(path)
+            raise
+        return path, digest.hexdigest()
+
+    def _lookup_encoded(self, encoded_digest: str) -> Optional[str]:
+        """Return the stored path of an encoded part decoded before"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT sha256 FROM encoded WHERE encoded_sha256 = ?", (encoded_digest,)
+            ).fetchone()
+        return self.get_path(row[0]) if row else None
+
+    def _decode_file(self, encoded_path: str, encoding: str) -> tuple:
+        """Decode a spooled part into a new temporary file, returning its path, hash and size"""
+        decoder = _StreamDecoder(encoding)
+        digest = hashlib.sha256()
+        size = 0
+        fd, path = tempfile.mkstemp(dir=os.path.join(self.root, "tmp"))
+
+        try:
+            with open(encoded_path, "rb") as source, os.fdopen(fd, "wb") as target:
+                while True:
+                    chunk = source.read(_CHUNK_SIZE)
+                    data = decoder.decode(chunk) if chunk else decoder.flush()
+                    digest.update(data)
+                    target.write(data)
+                    size += len(data)
+                    if not chunk:
+                        break
+        except Exception:
+            os.remove(path)
+            raise
+
+        return path, digest.hexdigest(), size
+
+    def _store(self, decoded_path: str, digest: str, filename: str) -> str:
+        """Move a decoded file into place, or drop it if the content is already stored"""
+        directory = os.path.join(self.root, "objects", digest[:2], digest)
+        with self._lock:
+            if os.path.isdir(directory) and os.listdir(directory):
+                os.remove(decoded_path)
+                self.duplicates += 1
+                return os.path.join(directory, sorted(os.listdir(directory))[0])
+
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, self._safe_filename(filename))
+            os.replace(decoded_path, path)
+            self.stored += 1
+            return path
+
+    def _safe_filename(self, filename: str) -> str:
+        """Strip directory parts and unsafe characters from an attachment filename"""
+        name = os.path.basename((filename or "").replace("\\", "/"))
+        name = re.sub(r'[^\w.\- ()]', '_', name).strip(". ")
+        return name or "attachment"
@@ -0,0 +1,95 @@
+from typing import Dict, Iterable, Iterator, List
+
+import pandas as pd
+
+
+_MISSING = object()
+
+
+class EmailBatch:
+    """Columnar container of email records
+
+    Records are stored as one list per field instead of one dict per email,
+    which keeps large fetches compact. Indexing and iteration return record
+    dicts built on the fly, so code written for lists of dicts keeps working;
+    assign back with batch[i] = record to persist changes to a record.
+    """
+
+    def __init__(self, emails: Iterable[Dict] = ()):
+        self._columns: Dict[str, List] = {}
+        self._length = 0
+        self.extend(emails)
+
+    @property
+    def fields(self) -> List[str]:
+        """Names of the fields present in any record"""
+        return list(self._columns)
+
+    def append(self, email_data: Dict):
+        """Add a record to the end of the batch"""
+        for key in email_data:
+            if key not in self._columns:
+                self._columns[key] = [_MISSING] * self._length
+
+        for key, column in self._columns.items():
+            column.append(email_data.get(key, _MISSING))
+        self._length += 1
+
+    def extend(self, emails: Iterable[Dict]):
+        """Add records from any iterable of dicts (or another batch)"""
+        for email_data in emails:
+            self.append(email_data)
+
+    def column(self, name: str, default=None) -> List:
+        """Return the values of one field, with default for records that lack it"""
+        column = self._columns.get(name)
+        if column is None:
+            return [default] * self._length
+        return [default if value is _MISSING else value for value in column]
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """Build a DataFrame with one column per field"""
+        return pd.DataFrame({name: self.column(name) for name in self._columns})
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __iter__(self) -> Iterator[Dict]:
+        for index in range(self._length):
+            yield self._record(index)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return EmailBatch(self._record(i) for i in range(*index.indices(self._length)))
+
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("EmailBatch index out of range")
+        return self._record(index)
+
+    def __setitem__(self, index: int, email_data: Dict):
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("EmailBatch index out of range")
+
+        for key in email_data:
+            if key not in self._columns:
+                self._columns[key] = [_MISSING] * self._length
+
+        for key, column in self._columns.items():
+            column[index] = email_data.get(key, _MISSING)
+
+    def __add__(self, other: Iterable[Dict]) -> "EmailBatch":
+        batch = EmailBatch(self)
+        batch.extend(other)
+        return batch
+
+    def __repr__(self) -> str:
+        return f"EmailBatch({self._length} emails, fields={self.fields})"
+
+    def _record(self, index: int) -> Dict:
+        """Build the dict for one record"""
+        return {key: column[index] for key, column in self._columns.items()
+                if column[index] is not _MISSING}
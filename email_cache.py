@@ -0,0 +1,166 @@
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+
+class EmailCache:
+    """Persistent SQLite cache of parsed email records per account and folder"""
+
+    def __init__(self, path: str = "email_cache.sqlite3"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS folders (
+                account TEXT NOT NULL,
+                folder TEXT NOT NULL,
+                uidvalidity INTEGER NOT NULL,
+                synced_uid INTEGER NOT NULL DEFAULT 0,
+                highest_modseq INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (account, folder)
+            );
+            CREATE TABLE IF NOT EXISTS emails (
+                account TEXT NOT NULL,
+                folder TEXT NOT NULL,
+                uid INTEGER NOT NULL,
+                record TEXT NOT NULL,
+                PRIMARY KEY (account, folder, uid)
+            );
+        """)
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(folders)")]
+        if "highest_modseq" not in columns:
+            self._db.execute("ALTER TABLE folders ADD COLUMN highest_modseq INTEGER NOT NULL DEFAULT 0")
+        if "synced_uid" not in columns:
+            self._db.execute("ALTER TABLE folders ADD COLUMN synced_uid INTEGER NOT NULL DEFAULT 0")
+        self._db.commit()
+
+    def get_folder_state(self, account: str, folder: str) -> Optional[Dict]:
+        """Return the stored UIDVALIDITY, fully synced UID and MODSEQ for a folder"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT uidvalidity, synced_uid, highest_modseq FROM folders WHERE account = ? AND folder = ?",
+                (account, folder)
+            ).fetchone()
+
+        if row is None:
+            return None
+        return {"uidvalidity": row[0], "synced_uid": row[1], "highest_modseq": row[2]}
+
+    def validate_folder(self, account: str, folder: str, uidvalidity: int) -> bool:
+        """Check the cached UIDVALIDITY, discarding the folder's records if it changed"""
+        state = self.get_folder_state(account, folder)
+        if state is not None and state["uidvalidity"] == uidvalidity:
+            return True
+
+        with self._lock:
+            self._db.execute("DELETE FROM emails WHERE account = ? AND folder = ?", (account, folder))
+            self._db.execute(
+                "INSERT OR REPLACE INTO folders (account, folder, uidvalidity) VALUES (?, ?, ?)",
+                (account, folder, uidvalidity)
+            )
+            self._db.commit()
+        return False
+
+    def get_emails(self, account: str, folder: str, uids: Iterable) -> Dict[str, Dict]:
+        """Load cached records for the given UIDs, keyed by UID string"""
+        uids = [int(uid) for uid in uids]
+        records = {}
+
+        with self._lock:
+            for start in range(0, len(uids), 500):
+                chunk = uids[start:start + 500]
+                rows = self._db.execute(
+                    f"SELECT uid, record FROM emails WHERE account = ? AND folder = ? "
+                    f"AND uid IN ({','.join('?' * len(chunk))})",
+                    [account, folder] + chunk
+                ).fetchall()
+                for uid, record in rows:
+                    records[str(uid)] = self._decode(record)
+
+        return records
+
+    def store_emails(self, account: str, folder: str, emails: List[Dict]):
+        """Insert or replace records"""
+        if not emails:
+            return
+
+        rows = [(account, folder, int(e["id"]), self._encode(e)) for e in emails]
+
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO emails (account, folder, uid, record) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self._db.commit()
+
+    def set_synced_uid(self, account: str, folder: str, uid: int):
+        """Record that every message of the folder up to uid is cached"""
+        with self._lock:
+            self._db.execute(
+                "UPDATE folders SET synced_uid = ? WHERE account = ? AND folder = ?",
+                (uid, account, folder)
+            )
+            self._db.commit()
+
+    def get_uids(self, account: str, folder: str) -> List[int]:
+        """Return all cached UIDs of a folder in ascending order"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT uid FROM emails WHERE account = ? AND folder = ? ORDER BY uid",
+                (account, folder)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def update_flags(self, account: str, folder: str, flags: Dict[str, List[str]]) -> int:
+        """Replace the flags of cached records, returning how many were updated"""
+        emails = self.get_emails(account, folder, flags)
+        for uid, email_data in emails.items():
+            email_data["flags"] = flags[uid]
+        self.store_emails(account, folder, list(emails.values()))
+        return len(emails)
+
+    def delete_uid_ranges(self, account: str, folder: str, ranges: List[tuple]) -> int:
+        """Delete cached records whose UIDs fall in the given (low, high) ranges"""
+        deleted = 0
+        with self._lock:
+            for low, high in ranges:
+                cursor = self._db.execute(
+                    "DELETE FROM emails WHERE account = ? AND folder = ? AND uid BETWEEN ? AND ?",
+                    (account, folder, low, high)
+                )
+                deleted += cursor.rowcount
+            self._db.commit()
+        return deleted
+
+    def set_highest_modseq(self, account: str, folder: str, modseq: int):
+        """Record the MODSEQ the folder's cached records are synchronized to"""
+        with self._lock:
+            self._db.execute(
+                "UPDATE folders SET highest_modseq = ? WHERE account = ? AND folder = ?",
+                (modseq, account, folder)
+            )
+            self._db.commit()
+
+    def close(self):
+        """Close the underlying database"""
+        with self._lock:
+            self._db.close()
+
+    def _encode(self, email_data: Dict) -> str:
+        """Serialize a record, storing dates as ISO strings"""
+        data = dict(email_data)
+        if isinstance(data.get("date"), datetime):
+            data["date"] = data["date"].isoformat()
+        return json.dumps(data)
+
+    def _decode(self, record: str) -> Dict:
+        """Deserialize a record stored by _encode"""
+        data = json.loads(record)
+        if isinstance(data.get("date"), str):
+            try:
+                data["date"] = datetime.fromisoformat(data["date"])
+            except ValueError:
+                pass
+        return data
@@ -0,0 +1,64 @@
+import hashlib
+import re
+import threading
+from typing import Dict, Iterable, Iterator, Set
+
+from email_batch import EmailBatch
+from email_threading import parse_message_ids
+
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def dedup_key(email_data: Dict) -> str:
+    """Identity of a message for deduplication
+
+    The Message-ID when the record has one; otherwise a SHA-256 of the
+    normalized From/To/Subject/Date headers and, when loaded, the body.
+    """
+    message_ids = parse_message_ids(email_data.get("message_id"))
+    if message_ids:
+        return "id:" + message_ids[0]
+
+    fields = [email_data.get(name) or "" for name in ("from", "to", "subject")]
+    date = email_data.get("date")
+    fields.append(date.isoformat() if hasattr(date, "isoformat") else str(date or ""))
+    if email_data.get("body_loaded", True):
+        fields.append(email_data.get("body") or "")
+
+    normalized = "\0".join(_WHITESPACE_RE.sub(" ", str(field)).strip().lower() for field in fields)
+    return "sha256:" + hashlib.sha256(normalized.encode("utf-8", errors="replace")).hexdigest()
+
+
+class EmailDeduplicator:
+    """Hash index of messages already seen, shared across folders and accounts
+
+    The first record with a given key is kept; later ones are counted in
+    duplicates and dropped. Safe to use from several fetch threads.
+    """
+
+    def __init__(self):
+        self.duplicates = 0
+        self._seen: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def is_duplicate(self, email_data: Dict) -> bool:
+        """Record a message and report whether an identical one was seen before"""
+        key = dedup_key(email_data)
+        with self._lock:
+            if key in self._seen:
+                self.duplicates += 1
+                return True
+            self._seen.add(key)
+            return False
+
+    def filter(self, emails: Iterable[Dict]) -> Iterator[Dict]:
+        """Yield only the records not seen before, e.g. around iter_emails()"""
+        for email_data in emails:
+            if not self.is_duplicate(email_data):
+                yield email_data
+
+
+def deduplicate(emails: Iterable[Dict]) -> EmailBatch:
+    """Return the records of emails with duplicates removed, keeping the first"""
+    return EmailBatch(EmailDeduplicator().filter(emails))
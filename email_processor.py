@@ -1,29 +1,131 @@
-import imaplib
 import email
+import email.utils
 from email.header import decode_header
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import Callable, Dict, Iterator, List, Optional
 import base64
+import functools
+import html
+import quopri
 import re
+import select
+import ssl
+import threading
+import time
+
+from attachment_store import AttachmentStore
+from email_batch import EmailBatch
+from email_cache import EmailCache
+from email_dedup import EmailDeduplicator
+from email_threading import parse_message_ids
+from html_text import html_to_text
+from mime_parser import decode_text_part, parse_message
+from imap_compress import CompressedIMAP4_SSL
+from imap_pool import IMAPConnectionPool
+from raw_store import RawMessageStore
+from imap_response import (
+    expand_sequence_set, parse_bodystructure, parse_envelope, parse_esearch,
+    parse_fetch_response, sequence_set_ranges, tail_of_sequence_set, uid_set
+)
+
+
+HEADER_CACHE_SIZE = 4096
+
+GMAIL_BATCH_SIZE = 50
+
+GMAIL_MAX_BATCH_SIZE = 100
+
+GMAIL_LIST_PAGE_SIZE = 500
+
+GMAIL_METADATA_HEADERS = ["Subject", "From", "To", "Date", "Message-ID", "In-Reply-To", "References"]
+
+GMAIL_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+HEADER_FETCH_ITEMS = "(UID FLAGS RFC822.SIZE ENVELOPE BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS (REFERENCES)])"
 
 
 class EmailProcessor:
     """Process emails from IMAP or Gmail API"""
     
-    def __init__(self):
+    def __init__(self, cache: Optional[EmailCache] = None, raw_store: Optional[RawMessageStore] = None):
         self.connection = None
         self.email_address = None
+        self.batch_size = 200
+        self.selected_folder = None
+        self.uidvalidity = None
+        self.exists = 0
+        self.highest_modseq = 0
+        self._idle_count = 0
+        self.cache = cache
+        self.raw_store = raw_store
+        self.max_connections = 4
+        self.use_compression = True
+        self.pool = None
+        self._credentials = None
+        self.parse_workers = 0
+        self._parse_executor = None
     
     def connect_imap(self, email_address: str, password: str, imap_server: str = "imap.gmail.com") -> bool:
         """Connect to email server using IMAP"""
         try:
-            self.connection = imaplib.IMAP4_SSL(imap_server)
-            self.connection.login(email_address, password)
+            self.connection = self._open_connection(email_address, password, imap_server)
             self.email_address = email_address
+            self.selected_folder = None
+            self._credentials = (email_address, password, imap_server)
             return True
         except Exception as e:
             raise Exception(f"Failed to connect: {str(e)}")
     
+    def _open_connection(self, email_address: str, password: str, imap_server: str):
+        """Open and authenticate a new IMAP connection
+        
+        Capabilities are refreshed after login; COMPRESS=DEFLATE is negotiated
+        when offered and use_compression is set, and QRESYNC (or CONDSTORE) is
+        enabled so MODSEQ-based resyncs work.
+        """
+        connection = CompressedIMAP4_SSL(imap_server)
+        connection.login(email_address, password)
+        
+        status, data = connection.capability()
+        if status == "OK" and data and data[-1]:
+            connection.capabilities = tuple(data[-1].decode().upper().split())
+        
+        if self.use_compression:
+            connection.compress()
+        
+        if "ENABLE" in connection.capabilities:
+            for extension in ("QRESYNC", "CONDSTORE"):
+                if extension in connection.capabilities:
+                    connection.enable(extension)
+                    break
+        return connection
+    
+    @property
+    def compression_ratio(self) -> float:
+        """Decompressed-to-wire ratio of data received on the main connection"""
+        return getattr(self.connection, "compression_ratio", 1.0)
+    
+    def _get_pool(self) -> IMAPConnectionPool:
+        """Create the connection pool for this account on first use"""
+        if not self._credentials:
+            raise Exception("Not connected to email server")
+        
+        if self.pool is None:
+            self.pool = IMAPConnectionPool(
+                lambda: self._open_connection(*self._credentials),
+                max_connections=self.max_connections
+            )
+        return self.pool
+    
+    def _worker(self, connection) -> "EmailProcessor":
+        """Create a processor bound to a pooled connection for use on one thread"""
+        worker = EmailProcessor(cache=self.cache, raw_store=self.raw_store)
+        worker.connection = connection
+        worker.email_address = self.email_address
+        worker.batch_size = self.batch_size
+        return worker
+    
     def get_folders(self) -> List[str]:
         """Get list of available email folders"""
         if not self.connection:
@@ -40,43 +142,997 @@ class EmailProcessor:
             raise Exception(f"Failed to get folders: {str(e)}")
     
     def fetch_emails(self, folder: str = "INBOX", limit: Optional[int] = None, 
-                     search_criteria: str = "ALL") -> List[Dict]:
-        """Fetch emails from specified folder"""
+                     search_criteria: str = "ALL", batch_size: Optional[int] = None,
+                     headers_only: bool = False, parallelism: int = 1,
+                     body_limit: Optional[int] = None) -> EmailBatch:
+        """Fetch emails from specified folder, batch_size messages per UID FETCH
+        
+        With headers_only, only ENVELOPE/BODYSTRUCTURE/RFC822.SIZE are fetched and
+        bodies are left empty until load_body or load_bodies is called. With
+        body_limit, only the first body_limit bytes of the text part are
+        downloaded and attachment parts are never fetched. With
+        parallelism > 1 the UIDs are split into contiguous ranges fetched over
+        that many pooled connections.
+        """
         if not self.connection:
             raise Exception("Not connected to email server")
         
+        batch_size = batch_size or self.batch_size
+        
         try:
-            self.connection.select(folder)
-            status, messages = self.connection.search(None, search_criteria)
+            email_ids = self._search_uids(folder, search_criteria, limit)
+            self._resync_cache(folder)
             
+            if parallelism <= 1 or len(email_ids) <= batch_size:
+                emails = EmailBatch(self._iter_uids(folder, email_ids, batch_size, headers_only, body_limit))
+            else:
+                cached = self._cached_emails(folder, email_ids, headers_only, body_limit)
+                missing = [uid for uid in email_ids if uid.decode() not in cached]
+                fetched = self._fetch_partitioned(folder, missing, batch_size, headers_only, parallelism, body_limit)
+                
+                emails = EmailBatch()
+                for uid in email_ids:
+                    email_data = fetched.get(uid.decode()) or cached.get(uid.decode())
+                    if email_data:
+                        emails.append(email_data)
+            
+            self._mark_synced(folder, search_criteria, limit, email_ids, len(emails))
+            return emails
+        except Exception as e:
+            raise Exception(f"Failed to fetch emails: {str(e)}")
+    
+    def iter_emails(self, folder: str = "INBOX", limit: Optional[int] = None,
+                    search_criteria: str = "ALL", batch_size: Optional[int] = None,
+                    headers_only: bool = False, body_limit: Optional[int] = None) -> Iterator[Dict]:
+        """Yield emails from specified folder as each batch is parsed
+        
+        Only one batch of messages is held in memory at a time, so large
+        folders can be exported incrementally.
+        """
+        if not self.connection:
+            raise Exception("Not connected to email server")
+        
+        batch_size = batch_size or self.batch_size
+        
+        try:
+            email_ids = self._search_uids(folder, search_criteria, limit)
+            self._resync_cache(folder)
+            count = 0
+            for email_data in self._iter_uids(folder, email_ids, batch_size, headers_only, body_limit):
+                count += 1
+                yield email_data
+            self._mark_synced(folder, search_criteria, limit, email_ids, count)
+        except Exception as e:
+            raise Exception(f"Failed to fetch emails: {str(e)}")
+    
+    def iter_stored_emails(self, folder: Optional[str] = None, account: Optional[str] = None) -> Iterator[Dict]:
+        """Re-parse messages kept in the raw store without contacting the server"""
+        if not self.raw_store:
+            raise Exception("No raw message store configured")
+        
+        for location, raw_email in self.raw_store.iter_messages(account or self.email_address, folder):
+            email_data = self._parse_email(location["uid"], raw_email)
+            if email_data:
+                email_data["folder"] = location["folder"]
+                email_data["body_loaded"] = True
+                yield email_data
+    
+    def _search_uids(self, folder: str, search_criteria: str, limit: Optional[int]) -> List[bytes]:
+        """Select a folder and return the UIDs matching the criteria
+        
+        For "last N" requests the full UID list is never transferred: plain ALL
+        searches are narrowed to the last N sequence numbers, and other
+        criteria use ESEARCH (RFC 4731) when the server supports it. A full
+        ALL search of a fully cached folder only asks for UIDs above the
+        synced UID.
+        """
+        self._select(folder, refresh=True)
+        
+        if not limit and search_criteria.strip().upper() == "ALL":
+            email_ids = self._cached_folder_uids(folder)
+            if email_ids is not None:
+                return email_ids
+        
+        if limit and search_criteria.strip().upper() == "ALL":
+            if not self.exists:
+                return []
+            search_criteria = f"{max(1, self.exists - limit + 1)}:*"
+        
+        if self._supports("ESEARCH"):
+            result = self._esearch(search_criteria, "ALL")
+            if limit:
+                return tail_of_sequence_set(result.get("ALL", ""), limit)
+            return expand_sequence_set(result.get("ALL", ""))
+        
+        status, messages = self.connection.uid("SEARCH", search_criteria)
+        
+        if status != "OK":
+            raise Exception("Failed to search emails")
+        
+        email_ids = messages[0].split()
+        
+        if limit:
+            email_ids = email_ids[-limit:]
+        
+        return email_ids
+    
+    def _cached_folder_uids(self, folder: str) -> Optional[List[bytes]]:
+        """Return every UID of the selected folder from the cache plus the newer UIDs
+        
+        Only used once a full ALL fetch has cached every message up to the
+        folder's synced UID (see _mark_synced). Cached records are resynced,
+        then only UID <synced_uid + 1>:* is searched. New messages always get
+        UIDs above the synced one, so the server's older UIDs are a subset of
+        the cached ones and the two sets are equal exactly when the counts
+        add up to EXISTS. Otherwise (messages expunged without a resync)
+        None is returned and a full search is needed.
+        """
+        if not self.cache or not self.cache.validate_folder(self.email_address, folder, self.uidvalidity):
+            return None
+        
+        synced_uid = self.cache.get_folder_state(self.email_address, folder)["synced_uid"]
+        if not synced_uid:
+            return None
+        
+        self._resync_cache(folder)
+        cached_uids = [uid for uid in self.cache.get_uids(self.email_address, folder) if uid <= synced_uid]
+        new_uids = self._uids_after(synced_uid)
+        if len(cached_uids) + len(new_uids) != self.exists:
+            return None
+        
+        return [str(uid).encode() for uid in cached_uids] + new_uids
+    
+    def _mark_synced(self, folder: str, search_criteria: str, limit: Optional[int],
+                     email_ids: List[bytes], fetched: int):
+        """Record that a complete ALL fetch left every UID of the folder in the cache
+        
+        Cached records up to the synced UID that the search no longer returned
+        were expunged on the server and are dropped.
+        """
+        if not self.cache or limit or search_criteria.strip().upper() != "ALL" or not email_ids:
+            return
+        if fetched != len(email_ids):
+            return
+        
+        account = self.email_address
+        server_uids = {int(uid) for uid in email_ids}
+        synced_uid = max(server_uids)
+        expunged = [uid for uid in self.cache.get_uids(account, folder) if uid <= synced_uid and uid not in server_uids]
+        self.cache.delete_uid_ranges(account, folder, [(uid, uid) for uid in expunged])
+        self.cache.set_synced_uid(account, folder, synced_uid)
+    
+    def count_emails(self, folder: str = "INBOX", search_criteria: str = "ALL") -> int:
+        """Count matching emails, using ESEARCH COUNT when the server supports it"""
+        if not self.connection:
+            raise Exception("Not connected to email server")
+        
+        try:
+            self._select(folder, refresh=True)
+            if search_criteria.strip().upper() == "ALL":
+                return self.exists
+            if self._supports("ESEARCH"):
+                return int(self._esearch(search_criteria, "COUNT").get("COUNT", 0))
+            
+            status, messages = self.connection.uid("SEARCH", search_criteria)
             if status != "OK":
                 raise Exception("Failed to search emails")
+            return len(messages[0].split())
+        except Exception as e:
+            raise Exception(f"Failed to count emails: {str(e)}")
+    
+    def resync_folder(self, folder: str = "INBOX") -> Dict[str, int]:
+        """Bring cached records of a folder up to date with flag changes and expunges
+        
+        Uses CONDSTORE (RFC 7162) to fetch only flags changed since the last
+        synchronized MODSEQ, and QRESYNC VANISHED responses to drop expunged
+        messages. Returns the number of records updated and removed.
+        """
+        if not self.connection:
+            raise Exception("Not connected to email server")
+        if not self.cache:
+            raise Exception("Resync requires an EmailCache")
+        
+        try:
+            self._select(folder, refresh=True)
+            return self._resync_cache(folder)
+        except Exception as e:
+            raise Exception(f"Failed to resync folder: {str(e)}")
+    
+    def _resync_cache(self, folder: str) -> Dict[str, int]:
+        """Apply changes since the cached MODSEQ of the selected folder to the cache"""
+        result = {"updated": 0, "removed": 0}
+        if not self.cache or not self.highest_modseq:
+            return result
+        
+        account = self.email_address
+        if not self.cache.validate_folder(account, folder, self.uidvalidity):
+            self.cache.set_highest_modseq(account, folder, self.highest_modseq)
+            return result
+        
+        since = self.cache.get_folder_state(account, folder)["highest_modseq"]
+        if since == self.highest_modseq:
+            return result
+        
+        qresync = self._supports("QRESYNC") and self._supports("ENABLE")
+        if since:
+            modifier = f"(CHANGEDSINCE {since} VANISHED)" if qresync else f"(CHANGEDSINCE {since})"
+            status, msg_data = self.connection.uid("FETCH", "1:*", "(UID FLAGS)", modifier)
+        else:
+            cached_uids = self.cache.get_uids(account, folder)
+            if not cached_uids:
+                self.cache.set_highest_modseq(account, folder, self.highest_modseq)
+                return result
+            status, msg_data = self.connection.uid("FETCH", uid_set(cached_uids), "(UID FLAGS)")
+        
+        if status != "OK":
+            raise Exception("Failed to fetch changed flags")
+        
+        flags = {
+            str(items["UID"]): self._flags(items)
+            for _, items in parse_fetch_response(msg_data) if "UID" in items and "FLAGS" in items
+        }
+        result["updated"] = self.cache.update_flags(account, folder, flags)
+        
+        if since and qresync:
+            _, vanished = self.connection.response("VANISHED")
+            ranges = []
+            for data in vanished or []:
+                if data:
+                    ranges.extend(sequence_set_ranges(data.decode().replace("(EARLIER)", "").strip()))
+            result["removed"] = self.cache.delete_uid_ranges(account, folder, ranges)
+        else:
+            server_uids = {int(uid) for uid in flags} if not since else {int(uid) for uid in self._search_uids_all()}
+            expunged = [uid for uid in self.cache.get_uids(account, folder) if uid not in server_uids]
+            result["removed"] = self.cache.delete_uid_ranges(account, folder, [(uid, uid) for uid in expunged])
+        
+        self.cache.set_highest_modseq(account, folder, self.highest_modseq)
+        return result
+    
+    def iter_new_emails(self, folder: str = "INBOX", idle_timeout: int = 29 * 60,
+                        stop_event: Optional[threading.Event] = None, headers_only: bool = False,
+                        poll_interval: int = 60) -> Iterator[Dict]:
+        """Yield emails as they arrive in a folder until stop_event is set
+        
+        Uses IMAP IDLE (RFC 2177) to wait for new-message notifications and
+        fetches only the new UIDs; IDLE is re-issued every idle_timeout seconds
+        to stay under server inactivity limits. Servers without IDLE are polled
+        with NOOP every poll_interval seconds.
+        """
+        if not self.connection:
+            raise Exception("Not connected to email server")
+        
+        try:
+            self._select(folder, refresh=True)
+            if self.cache:
+                self.cache.validate_folder(self.email_address, folder, self.uidvalidity)
+                self._resync_cache(folder)
+            last_uid = self._highest_uid()
+            
+            while not (stop_event and stop_event.is_set()):
+                if self._supports("IDLE"):
+                    changed = self._idle(idle_timeout, stop_event)
+                else:
+                    changed = self._poll(poll_interval, stop_event)
+                
+                if not changed:
+                    continue
+                
+                new_ids = self._uids_after(last_uid)
+                if not new_ids:
+                    continue
+                
+                fetched = self._fetch_uids(new_ids, self.batch_size, headers_only)
+                for uid in new_ids:
+                    if uid.decode() in fetched:
+                        yield fetched[uid.decode()]
+                last_uid = max(int(uid) for uid in new_ids)
+        except Exception as e:
+            raise Exception(f"Failed to watch folder: {str(e)}")
+    
+    def watch(self, folder: str = "INBOX", on_email: Optional[Callable[[Dict], None]] = None,
+              export_csv: Optional[str] = None, stop_event: Optional[threading.Event] = None,
+              headers_only: bool = False) -> int:
+        """Continuously ingest new emails from a folder until stop_event is set
+        
+        New emails are stored in the cache (when one is configured), passed
+        to on_email, and appended to export_csv if given. Returns the number
+        of emails received.
+        """
+        from excel_exporter import ExcelExporter
+        
+        exporter = ExcelExporter() if export_csv else None
+        received = 0
+        for email_data in self.iter_new_emails(folder, stop_event=stop_event, headers_only=headers_only):
+            received += 1
+            if on_email:
+                on_email(email_data)
+            if exporter:
+                exporter.append_to_csv([email_data], export_csv)
+        return received
+    
+    def _highest_uid(self) -> int:
+        """Return the UID of the newest message in the selected folder"""
+        if not self.exists:
+            return 0
+        status, messages = self.connection.uid("SEARCH", "*")
+        if status != "OK" or not messages or not messages[0]:
+            return 0
+        return max(int(uid) for uid in messages[0].split())
+    
+    def _uids_after(self, last_uid: int) -> List[bytes]:
+        """Return UIDs greater than last_uid in the selected folder"""
+        status, messages = self.connection.uid("SEARCH", f"UID {last_uid + 1}:*")
+        if status != "OK":
+            raise Exception("Failed to search new emails")
+        return [uid for uid in (messages[0] or b"").split() if int(uid) > last_uid]
+    
+    def _idle(self, timeout: int, stop_event: Optional[threading.Event]) -> bool:
+        """Run one IDLE cycle, returning True if the server reported mailbox changes"""
+        self._idle_count += 1
+        tag = b"IDLE%d" % self._idle_count
+        self.connection.send(tag + b" IDLE\r\n")
+        
+        line = self.connection.readline()
+        if not line.startswith(b"+"):
+            raise Exception(f"IDLE rejected: {line.decode(errors='replace').strip()}")
+        
+        changed = False
+        deadline = time.monotonic() + timeout
+        while not changed and not (stop_event and stop_event.is_set()):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if self._wait_readable(min(1.0, remaining)):
+                changed = self._is_mailbox_update(self.connection.readline())
+        
+        self.connection.send(b"DONE\r\n")
+        while True:
+            line = self.connection.readline()
+            if line.startswith(tag + b" "):
+                if not line[len(tag) + 1:].upper().startswith(b"OK"):
+                    raise Exception(f"IDLE failed: {line.decode(errors='replace').strip()}")
+                return changed
+            changed = self._is_mailbox_update(line) or changed
+    
+    def _is_mailbox_update(self, line: bytes) -> bool:
+        """Check whether an untagged line received during IDLE reports a change"""
+        if not line:
+            raise Exception("Connection closed by server")
+        if line.startswith(b"* BYE"):
+            raise Exception(f"Server closed connection: {line.decode(errors='replace').strip()}")
+        return line.startswith(b"* ") and not line.startswith(b"* OK")
+    
+    def _wait_readable(self, timeout: float) -> bool:
+        """Wait until the connection has data to read"""
+        if self._has_buffered_input():
+            return True
+        readable, _, _ = select.select([self.connection.sock], [], [], timeout)
+        return bool(readable)
+    
+    def _has_buffered_input(self) -> bool:
+        """Check without blocking whether a line is already buffered or decrypted"""
+        if getattr(self.connection, "pending_bytes", None) and self.connection.pending_bytes():
+            return True
+        
+        sock = self.connection.sock
+        timeout = sock.gettimeout()
+        sock.setblocking(False)
+        try:
+            return bool(self.connection.file.peek(1))
+        except (BlockingIOError, ssl.SSLWantReadError):
+            return False
+        finally:
+            sock.settimeout(timeout)
+    
+    def _poll(self, interval: int, stop_event: Optional[threading.Event]) -> bool:
+        """Wait interval seconds, then check for new messages with NOOP"""
+        if stop_event:
+            stop_event.wait(interval)
+            if stop_event.is_set():
+                return False
+        else:
+            time.sleep(interval)
+        
+        self.connection.noop()
+        _, exists = self.connection.response("EXISTS")
+        return bool(exists and exists[-1])
+    
+    def _search_uids_all(self) -> List[bytes]:
+        """Return every UID of the selected folder"""
+        if self._supports("ESEARCH"):
+            return expand_sequence_set(self._esearch("ALL", "ALL").get("ALL", ""))
+        
+        status, messages = self.connection.uid("SEARCH", "ALL")
+        if status != "OK":
+            raise Exception("Failed to search emails")
+        return messages[0].split()
+    
+    def _supports(self, capability: str) -> bool:
+        """Check whether the server advertised a capability"""
+        return capability in getattr(self.connection, "capabilities", ())
+    
+    def _esearch(self, search_criteria: str, return_options: str) -> Dict[str, str]:
+        """Run UID SEARCH RETURN (...) and parse the ESEARCH response"""
+        status, _ = self.connection.uid("SEARCH", f"RETURN ({return_options})", search_criteria)
+        
+        if status != "OK":
+            raise Exception("Failed to search emails")
+        
+        _, data = self.connection.response("ESEARCH")
+        return parse_esearch(data[-1] if data and data[-1] else b"")
+    
+    def _cached_emails(self, folder: str, email_ids: List[bytes], headers_only: bool,
+                       body_limit: Optional[int] = None) -> Dict[str, Dict]:
+        """Look up cached records for UIDs of the selected folder"""
+        if not self.cache:
+            return {}
+        
+        if not self.cache.validate_folder(self.email_address, folder, self.uidvalidity):
+            return {}
+        
+        cached = self.cache.get_emails(self.email_address, folder, email_ids)
+        if not headers_only:
+            cached = {uid: e for uid, e in cached.items() if e.get("body_loaded", True)}
+        if not headers_only and not body_limit:
+            cached = {uid: e for uid, e in cached.items() if not e.get("body_truncated", False)}
+        return cached
+    
+    def _iter_uids(self, folder: str, email_ids: List[bytes], batch_size: int,
+                   headers_only: bool, body_limit: Optional[int] = None) -> Iterator[Dict]:
+        """Yield records for UIDs in order, one batch at a time, using the cache
+        
+        When parse_workers is set, each downloaded batch is parsed in a process
+        pool while the next batch is being fetched.
+        """
+        executor = None if headers_only or body_limit else self._get_parse_executor()
+        pending = None
+        
+        for start in range(0, len(email_ids), batch_size):
+            batch_ids = email_ids[start:start + batch_size]
+            cached = self._cached_emails(folder, batch_ids, headers_only, body_limit)
+            missing = [uid for uid in batch_ids if uid.decode() not in cached]
             
-            email_ids = messages[0].split()
+            if executor:
+                futures = self._submit_parse(executor, self._fetch_raw_batch(missing)) if missing else []
+                if pending:
+                    yield from self._collect_parsed(folder, *pending)
+                pending = (batch_ids, cached, futures)
+                continue
             
-            if limit:
-                email_ids = email_ids[-limit:]
+            fetched = self._fetch_uids(missing, batch_size, headers_only, body_limit)
             
-            emails = []
-            for email_id in email_ids:
-                email_data = self._fetch_email_by_id(email_id)
+            for uid in batch_ids:
+                email_data = fetched.get(uid.decode()) or cached.get(uid.decode())
                 if email_data:
-                    emails.append(email_data)
+                    yield email_data
+        
+        if pending:
+            yield from self._collect_parsed(folder, *pending)
+    
+    def _get_parse_executor(self) -> Optional[ProcessPoolExecutor]:
+        """Create the MIME parsing process pool on first use, if enabled"""
+        if not self.parse_workers:
+            return None
+        
+        if self._parse_executor is None:
+            self._parse_executor = ProcessPoolExecutor(max_workers=self.parse_workers)
+        return self._parse_executor
+    
+    def _submit_parse(self, executor: ProcessPoolExecutor, raw_emails: List[tuple]) -> List[Future]:
+        """Split a downloaded batch into one parsing task per worker process"""
+        chunk_size = max(1, -(-len(raw_emails) // self.parse_workers))
+        return [
+            executor.submit(_parse_emails_worker, raw_emails[start:start + chunk_size])
+            for start in range(0, len(raw_emails), chunk_size)
+        ]
+    
+    def _collect_parsed(self, folder: str, batch_ids: List[bytes], cached: Dict[str, Dict],
+                        futures: List[Future]) -> Iterator[Dict]:
+        """Wait for a batch's parsing tasks, cache the records and yield them in UID order"""
+        fetched = {}
+        for future in futures:
+            for email_data in future.result():
+                if email_data:
+                    email_data["folder"] = folder
+                    email_data["body_loaded"] = True
+                    fetched[email_data["id"]] = email_data
+        
+        if self.cache and fetched:
+            self.cache.store_emails(self.email_address, folder, list(fetched.values()))
+        
+        for uid in batch_ids:
+            email_data = fetched.get(uid.decode()) or cached.get(uid.decode())
+            if email_data:
+                yield email_data
+    
+    def fetch_folders(self, folders: List[str], limit: Optional[int] = None,
+                      search_criteria: str = "ALL", headers_only: bool = False,
+                      max_workers: Optional[int] = None, body_limit: Optional[int] = None,
+                      deduplicator: Optional[EmailDeduplicator] = None) -> EmailBatch:
+        """Fetch several folders concurrently over pooled connections
+        
+        Each folder is fetched on its own worker thread with its own
+        connection (at most max_connections at once); results are merged in
+        the order the folders were given.
+        
+        With a deduplicator, a message already seen in an earlier folder (or
+        by another account sharing the deduplicator) is dropped. Headers are
+        fetched first in that case and bodies are downloaded afterwards for
+        the remaining messages only.
+        """
+        if not self.connection:
+            raise Exception("Not connected to email server")
+        
+        pool = self._get_pool()
+        headers_first = deduplicator is not None and not headers_only
+        
+        def fetch_folder(folder):
+            with pool.connection() as connection:
+                return self._worker(connection).fetch_emails(
+                    folder=folder,
+                    limit=limit,
+                    search_criteria=search_criteria,
+                    headers_only=headers_only or headers_first,
+                    body_limit=None if headers_first else body_limit
+                )
+        
+        workers = min(max_workers or pool.max_connections, pool.max_connections, max(len(folders), 1))
+        
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(fetch_folder, folders))
             
-            return emails
+            emails = EmailBatch()
+            for folder_emails in results:
+                emails.extend(deduplicator.filter(folder_emails) if deduplicator else folder_emails)
+            
+            if headers_first:
+                self._fetch_folder_bodies(emails, body_limit, workers)
         except Exception as e:
-            raise Exception(f"Failed to fetch emails: {str(e)}")
+            raise Exception(f"Failed to fetch folders: {str(e)}")
+        
+        return emails
     
-    def _fetch_email_by_id(self, email_id: bytes) -> Optional[Dict]:
-        """Fetch and parse a single email by ID"""
+    def _fetch_folder_bodies(self, emails: EmailBatch, body_limit: Optional[int], workers: int):
+        """Replace headers-only records with full (or body_limit) records, one pooled connection per folder"""
+        pending = {}
+        for index, email_data in enumerate(emails):
+            if not email_data.get("body_loaded", True) or (not body_limit and email_data.get("body_truncated")):
+                pending.setdefault(email_data.get("folder", "INBOX"), {})[email_data["id"]] = index
+        
+        if not pending:
+            return
+        
+        pool = self._get_pool()
+        
+        def fetch_bodies(folder):
+            with pool.connection() as connection:
+                worker = self._worker(connection)
+                worker._select(folder, refresh=True)
+                return folder, worker._fetch_uids(list(pending[folder]), worker.batch_size, body_limit=body_limit)
+        
+        with ThreadPoolExecutor(max_workers=min(workers, len(pending))) as executor:
+            for folder, fetched in executor.map(fetch_bodies, pending):
+                for uid, email_data in fetched.items():
+                    emails[pending[folder][uid]] = email_data
+    
+    def _fetch_uids(self, email_ids: List[bytes], batch_size: int, headers_only: bool = False,
+                    body_limit: Optional[int] = None) -> Dict[str, Dict]:
+        """Fetch UIDs from the selected folder in batches, caching each batch"""
+        fetched = {}
+        for start in range(0, len(email_ids), batch_size):
+            batch = self._fetch_batch(email_ids[start:start + batch_size], headers_only, body_limit)
+            if self.cache:
+                self.cache.store_emails(self.email_address, self.selected_folder, batch)
+            fetched.update((e["id"], e) for e in batch)
+        return fetched
+    
+    def _fetch_partitioned(self, folder: str, email_ids: List[bytes], batch_size: int,
+                           headers_only: bool, parallelism: int,
+                           body_limit: Optional[int] = None) -> Dict[str, Dict]:
+        """Split UIDs into contiguous ranges and fetch them on parallel connections"""
+        pool = self._get_pool()
+        parallelism = min(parallelism, pool.max_connections)
+        chunk_size = -(-len(email_ids) // parallelism)
+        ranges = [email_ids[start:start + chunk_size] for start in range(0, len(email_ids), chunk_size)]
+        uidvalidity = self.uidvalidity
+        
+        def fetch_range(uids):
+            with pool.connection() as connection:
+                worker = self._worker(connection)
+                worker._select(folder, refresh=True)
+                if worker.uidvalidity != uidvalidity:
+                    raise Exception(f"UIDVALIDITY of {folder} changed during fetch")
+                return worker._fetch_uids(uids, batch_size, headers_only, body_limit)
+        
+        fetched = {}
+        with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+            for result in executor.map(fetch_range, ranges):
+                fetched.update(result)
+        return fetched
+    
+    def _fetch_batch(self, email_ids: List[bytes], headers_only: bool = False,
+                     body_limit: Optional[int] = None) -> List[Dict]:
+        """Fetch and parse one batch of UIDs from the selected folder"""
+        if headers_only:
+            return self._fetch_headers_batch(email_ids)
+        if body_limit:
+            return self._fetch_partial_batch(email_ids, body_limit)
+        
+        emails = []
+        for uid, raw_email, flags in self._fetch_raw_batch(email_ids):
+            email_data = self._parse_email(uid, raw_email, flags)
+            if email_data:
+                email_data["folder"] = self.selected_folder
+                email_data["body_loaded"] = True
+                emails.append(email_data)
+        return emails
+    
+    def load_body(self, email_data: Dict) -> Dict:
+        """Download the body of a headers-only email record in place"""
+        return self.load_bodies([email_data])[0]
+    
+    def load_bodies(self, emails: List[Dict], batch_size: Optional[int] = None) -> List[Dict]:
+        """Download bodies for all headers-only records, batched per folder
+        
+        Records are updated in place; for an EmailBatch the updated records are
+        written back into the batch.
+        """
+        if not self.connection:
+            raise Exception("Not connected to email server")
+        
+        batch_size = batch_size or self.batch_size
+        pending = {}
+        positions = {}
+        for index, email_data in enumerate(emails):
+            if not email_data.get("body_loaded", True):
+                pending.setdefault(email_data.get("folder", "INBOX"), {})[email_data["id"]] = email_data
+                positions[id(email_data)] = index
+        
         try:
-            status, msg_data = self.connection.fetch(email_id, "(RFC822)")
+            for folder, by_uid in pending.items():
+                self._select(folder)
+                uids = list(by_uid)
+                for start in range(0, len(uids), batch_size):
+                    for uid, raw_email, flags in self._fetch_raw_batch(uids[start:start + batch_size]):
+                        full_data = self._parse_email(uid, raw_email, flags)
+                        if full_data:
+                            by_uid[uid].update(full_data, folder=folder, body_loaded=True)
+                if self.cache:
+                    self.cache.store_emails(self.email_address, folder, list(by_uid.values()))
+                for email_data in by_uid.values():
+                    emails[positions[id(email_data)]] = email_data
+        except Exception as e:
+            raise Exception(f"Failed to load email bodies: {str(e)}")
+        
+        return emails
+    
+    def save_attachments(self, emails: List[Dict], store: AttachmentStore,
+                         chunk_size: int = 1024 * 1024) -> int:
+        """Download the attachments of the given records into an AttachmentStore
+        
+        Attachment parts are located with BODYSTRUCTURE and fetched in
+        chunk_size ranges (BODY.PEEK[section]<offset.size>), so no payload is
+        held in memory whole. Stored paths are added to each record as
+        attachment_paths. Returns the number of attachments saved.
+        """
+        if not self.connection:
+            raise Exception("Not connected to email server")
+        
+        pending = {}
+        positions = {}
+        for index, email_data in enumerate(emails):
+            if email_data.get("has_attachments"):
+                pending.setdefault(email_data.get("folder", "INBOX"), {})[email_data["id"]] = email_data
+                positions[id(email_data)] = index
+        
+        saved = 0
+        try:
+            for folder, by_uid in pending.items():
+                self._select(folder)
+                for uid, details in self._fetch_attachment_details(list(by_uid)).items():
+                    if uid not in by_uid:
+                        continue
+                    for detail in details:
+                        detail["path"] = store.save(
+                            self._iter_part_chunks(uid, detail["section"], chunk_size),
+                            detail["filename"], detail["encoding"], detail["content_type"]
+                        )
+                        saved += 1
+                    
+                    email_data = by_uid[uid]
+                    email_data["attachment_details"] = details
+                    email_data["attachment_paths"] = [detail["path"] for detail in details]
+                    emails[positions[id(email_data)]] = email_data
+                
+                if self.cache:
+                    self.cache.store_emails(self.email_address, folder, list(by_uid.values()))
+        except Exception as e:
+            raise Exception(f"Failed to save attachments: {str(e)}")
+        
+        return saved
+    
+    def _fetch_attachment_details(self, email_ids: List) -> Dict[str, List[Dict]]:
+        """Fetch BODYSTRUCTURE for a batch of UIDs and return their attachment parts"""
+        status, msg_data = self.connection.uid("FETCH", uid_set(email_ids), "(UID BODYSTRUCTURE)")
+        if status != "OK":
+            raise Exception(f"Error fetching structure {uid_set(email_ids)}: {status}")
+        
+        return {
+            str(items["UID"]): self._attachment_details(parse_bodystructure(items.get("BODYSTRUCTURE")))
+            for _, items in parse_fetch_response(msg_data) if "UID" in items
+        }
+    
+    def _iter_part_chunks(self, uid: str, section: str, chunk_size: int) -> Iterator[bytes]:
+        """Yield the encoded bytes of one body part, chunk_size bytes per FETCH"""
+        offset = 0
+        while True:
+            status, data = self.connection.uid(
+                "FETCH", str(uid), f"(UID BODY.PEEK[{section}]<{offset}.{chunk_size}>)"
+            )
+            if status != "OK":
+                raise Exception(f"Error fetching part {section} of {uid}: {status}")
             
+            chunk = next((value for _, items in parse_fetch_response(data)
+                          for key, value in items.items() if key.startswith("BODY[")), None)
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            if not chunk:
+                return
+            
+            yield chunk
+            if len(chunk) < chunk_size:
+                return
+            offset += len(chunk)
+    
+    def _select(self, folder: str, refresh: bool = False):
+        """Select a folder unless it is already selected"""
+        if refresh or self.selected_folder != folder:
+            _, data = self.connection.select(folder)
+            self.selected_folder = folder
+            self.exists = int(data[0]) if data and data[0] and data[0].isdigit() else 0
+            _, modseq = self.connection.response("HIGHESTMODSEQ")
+            self.highest_modseq = int(modseq[-1]) if modseq and modseq[-1] else 0
+            self.uidvalidity = self._read_uidvalidity(folder)
+    
+    def _read_uidvalidity(self, folder: str) -> int:
+        """Read UIDVALIDITY from the SELECT response, falling back to STATUS"""
+        _, data = self.connection.response("UIDVALIDITY")
+        if not data or data[0] is None:
+            _, data = self.connection.status(folder, "(UIDVALIDITY)")
+            match = re.search(rb'UIDVALIDITY (\d+)', data[0] or b"")
+            return int(match.group(1)) if match else 0
+        return int(data[-1])
+    
+    def _fetch_headers_batch(self, email_ids: List[bytes]) -> List[Dict]:
+        """Fetch envelope, structure and size for a batch of UIDs"""
+        status, msg_data = self.connection.uid(
+            "FETCH", uid_set(email_ids), HEADER_FETCH_ITEMS
+        )
+        
+        if status != "OK":
+            print(f"Error fetching headers {uid_set(email_ids)}: {status}")
+            return []
+        
+        return self._parse_headers_response(msg_data, self.selected_folder)
+    
+    def _parse_headers_response(self, msg_data: List, folder: str) -> List[Dict]:
+        """Build headers-only records from an ENVELOPE/BODYSTRUCTURE FETCH response"""
+        emails = []
+        for _, items in sorted(parse_fetch_response(msg_data), key=lambda m: int(m[1].get("UID", 0))):
+            email_data = self._headers_record(items, folder)
+            if email_data:
+                emails.append(email_data)
+        
+        return emails
+    
+    def _headers_record(self, items: Dict, folder: str) -> Optional[Dict]:
+        """Build a headers-only record from one message's FETCH items"""
+        if "UID" not in items or "ENVELOPE" not in items:
+            return None
+        
+        envelope = parse_envelope(items["ENVELOPE"])
+        references = next((value for key, value in items.items() if key.startswith("BODY[HEADER.FIELDS")), None)
+        if isinstance(references, bytes):
+            references = references.decode("ascii", errors="replace")
+        attachment_details = self._attachment_details(parse_bodystructure(items.get("BODYSTRUCTURE")))
+        attachments = [detail["filename"] for detail in attachment_details]
+        size = str(items.get("RFC822.SIZE") or "0")
+        
+        return {
+            "id": str(items["UID"]),
+            "subject": self._decode_header(envelope["subject"]),
+            "from": self._decode_header(envelope["from"]),
+            "to": self._decode_header(envelope["to"]),
+            "date": self._parse_date(envelope["date"]),
+            "message_id": (envelope["message_id"] or "").strip(),
+            "in_reply_to": (envelope["in_reply_to"] or "").strip(),
+            "references": parse_message_ids(references),
+            "body": "",
+            "attachments": attachments,
+            "attachment_details": attachment_details,
+            "has_attachments": len(attachments) > 0,
+            "size": int(size) if size.isdigit() else 0,
+            "flags": self._flags(items),
+            "folder": folder,
+            "body_loaded": False
+        }
+    
+    def _attachment_details(self, parts: List[Dict]) -> List[Dict]:
+        """Describe attachment parts from BODYSTRUCTURE without downloading them
+        
+        Sizes of base64 parts are estimated from their encoded size.
+        """
+        return [
+            {
+                "filename": self._decode_header(part["filename"]),
+                "content_type": part["type"],
+                "size": part["size"] * 57 // 78 if part["encoding"] == "base64" else part["size"],
+                "section": part["section"],
+                "encoding": part["encoding"]
+            }
+            for part in parts
+            if part["disposition"] == "attachment" and part["filename"]
+        ]
+    
+    def _fetch_partial_batch(self, email_ids: List[bytes], body_limit: int) -> List[Dict]:
+        """Fetch envelopes plus the first body_limit bytes of each message's text part
+        
+        The text part is chosen from BODYSTRUCTURE and fetched with
+        BODY.PEEK[section]<0.N>, so attachments are never downloaded and the
+        messages are not marked as read.
+        """
+        status, msg_data = self.connection.uid(
+            "FETCH", uid_set(email_ids), HEADER_FETCH_ITEMS
+        )
+        
+        if status != "OK":
+            print(f"Error fetching headers {uid_set(email_ids)}: {status}")
+            return []
+        
+        records = {}
+        text_parts = {}
+        requests = {}
+        for _, items in parse_fetch_response(msg_data):
+            email_data = self._headers_record(items, self.selected_folder)
+            if not email_data:
+                continue
+            
+            email_data["body_loaded"] = True
+            records[email_data["id"]] = email_data
+            
+            part = self._select_text_part(parse_bodystructure(items.get("BODYSTRUCTURE")))
+            if part:
+                octets = self._partial_octets(part, body_limit)
+                email_data["body_truncated"] = part["size"] > octets
+                text_parts[email_data["id"]] = part
+                requests.setdefault((part["section"], octets), []).append(email_data["id"])
+        
+        for (section, octets), uids in requests.items():
+            status, body_data = self.connection.uid(
+                "FETCH", uid_set(uids), f"(UID BODY.PEEK[{section}]<0.{octets}>)"
+            )
             if status != "OK":
-                return None
+                print(f"Error fetching text parts {uid_set(uids)}: {status}")
+                continue
+            
+            for _, items in parse_fetch_response(body_data):
+                uid = str(items.get("UID", ""))
+                payload = next((value for key, value in items.items() if key.startswith("BODY[")), None)
+                if uid in records and payload is not None:
+                    records[uid]["body"] = self._decode_partial_body(payload, text_parts[uid], body_limit)
+        
+        return [records[uid] for uid in sorted(records, key=int)]
+    
+    def _select_text_part(self, parts: List[Dict]) -> Optional[Dict]:
+        """Pick the text/plain part, or the text/html part if there is no plain text"""
+        inline_parts = [part for part in parts if part["disposition"] != "attachment"]
+        for content_type in ("text/plain", "text/html"):
+            for part in inline_parts:
+                if part["type"] == content_type:
+                    return part
+        return None
+    
+    def _partial_octets(self, part: Dict, body_limit: int) -> int:
+        """Number of encoded octets to fetch for body_limit bytes of a text part
+        
+        Base64 lines carry 57 bytes in 78 octets (76 characters plus CRLF).
+        """
+        if part["encoding"] == "base64":
+            return -(-body_limit // 57) * 78
+        return body_limit
+    
+    def _decode_partial_body(self, payload, part: Dict, body_limit: int) -> str:
+        """Decode a possibly truncated body part using its transfer encoding and charset"""
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8", errors="replace")
+        
+        if part["encoding"] == "base64":
+            data = re.sub(rb'\s+', b'', payload)
+            data = base64.b64decode(data[:len(data) // 4 * 4])
+        elif part["encoding"] == "quoted-printable":
+            data = quopri.decodestring(re.sub(rb'=[0-9A-Fa-f]?$', b'', payload))
+        else:
+            data = payload
+        
+        charset = part["params"].get("charset") or "utf-8"
+        try:
+            text = data.decode(charset, errors="replace")
+        except LookupError:
+            text = data.decode("utf-8", errors="replace")
+        
+        if part["type"] == "text/html":
+            text = self._html_to_text(text, body_limit)
+        
+        return text[:body_limit].strip()
+    
+    def _fetch_raw_batch(self, email_ids: List[bytes]) -> List[tuple]:
+        """Fetch raw RFC822 bytes for a batch of UIDs with a single command
+        
+        With a raw store, messages already on disk are read from it and only
+        their FLAGS are fetched; downloaded messages are added to the store.
+        """
+        stored = {}
+        if self.raw_store:
+            stored = self.raw_store.get_uids(self.email_address, self.selected_folder, self.uidvalidity, email_ids)
+        missing = [uid for uid in email_ids if str(int(uid)) not in stored]
+        
+        raw_emails = []
+        if missing:
+            status, msg_data = self.connection.uid("FETCH", uid_set(missing), "(UID FLAGS BODY.PEEK[])")
+            if status == "OK":
+                raw_emails = self._parse_raw_response(msg_data)
+            else:
+                print(f"Error fetching batch {uid_set(missing)}: {status}")
             
-            email_body = msg_data[0][1]
-            email_message = email.message_from_bytes(email_body)
+            if self.raw_store:
+                for uid, raw_email, _ in raw_emails:
+                    self.raw_store.put(raw_email, self.email_address, self.selected_folder, self.uidvalidity, uid)
+        
+        if stored:
+            status, msg_data = self.connection.uid("FETCH", uid_set(stored), "(UID FLAGS)")
+            if status == "OK":
+                flags = {str(items["UID"]): self._flags(items)
+                         for _, items in parse_fetch_response(msg_data) if "UID" in items}
+                raw_emails += [(uid, raw_email, flags[uid]) for uid, raw_email in stored.items() if uid in flags]
+            else:
+                raw_emails += [(uid, raw_email, []) for uid, raw_email in stored.items()]
+        
+        return sorted(raw_emails, key=lambda raw: int(raw[0]))
+    
+    def _parse_raw_response(self, msg_data: List) -> List[tuple]:
+        """Extract (UID, raw RFC822 bytes, flags) triples from a FETCH response, in UID order"""
+        raw_emails = {}
+        for _, items in parse_fetch_response(msg_data):
+            raw_email = items.get("BODY[]", items.get("RFC822"))
+            if "UID" in items and isinstance(raw_email, bytes):
+                raw_emails[int(items["UID"])] = (raw_email, self._flags(items))
+        
+        return [(str(uid),) + raw_emails[uid] for uid in sorted(raw_emails)]
+    
+    def _flags(self, items: Dict) -> List[str]:
+        """Return the FLAGS of a FETCH item map as strings"""
+        flags = items.get("FLAGS")
+        return [str(flag) for flag in flags] if isinstance(flags, list) else []
+    
+    def _fetch_email_by_id(self, email_id: bytes) -> Optional[Dict]:
+        """Fetch and parse a single email by UID"""
+        try:
+            for uid, raw_email, flags in self._fetch_raw_batch([email_id]):
+                return self._parse_email(uid, raw_email, flags)
+            return None
+        except Exception as e:
+            print(f"Error processing email {email_id}: {str(e)}")
+            return None
+    
+    def _parse_email(self, email_id: str, email_body: bytes, flags: Optional[List[str]] = None) -> Optional[Dict]:
+        """Parse raw RFC822 bytes into an email record
+        
+        Attachment payloads are dropped while parsing; only their headers and
+        sizes are kept.
+        """
+        try:
+            email_message = parse_message(email_body)
             
             subject = self._decode_header(email_message["Subject"])
             from_addr = self._decode_header(email_message["From"])
@@ -85,40 +1141,35 @@ class EmailProcessor:
             
             date_obj = self._parse_date(date_str)
             
-            body, attachments = self._extract_body_and_attachments(email_message)
+            body, attachment_details = self._extract_body_and_attachments(email_message)
+            attachments = [detail["filename"] for detail in attachment_details]
             
             return {
-                "id": email_id.decode(),
+                "id": email_id,
                 "subject": subject,
                 "from": from_addr,
                 "to": to_addr,
                 "date": date_obj,
+                "message_id": str(email_message.get("Message-ID", "")).strip(),
+                "in_reply_to": str(email_message.get("In-Reply-To", "")).strip(),
+                "references": parse_message_ids(str(email_message.get("References", ""))),
                 "body": body,
                 "attachments": attachments,
-                "has_attachments": len(attachments) > 0
+                "attachment_details": attachment_details,
+                "has_attachments": len(attachments) > 0,
+                "flags": flags or []
             }
         except Exception as e:
             print(f"Error processing email {email_id}: {str(e)}")
             return None
     
     def _decode_header(self, header: str) -> str:
-        """Decode email header"""
+        """Decode email header, memoizing plain string values"""
         if not header:
             return ""
-        
-        decoded_parts = decode_header(header)
-        decoded_string = ""
-        
-        for part, encoding in decoded_parts:
-            if isinstance(part, bytes):
-                try:
-                    decoded_string += part.decode(encoding or "utf-8")
-                except:
-                    decoded_string += part.decode("utf-8", errors="ignore")
-            else:
-                decoded_string += part
-        
-        return decoded_string
+        if isinstance(header, str):
+            return _decode_header_cached(header)
+        return _decode_header_value(header)
     
     def _parse_date(self, date_str: str) -> datetime:
         """Parse email date string"""
@@ -128,7 +1179,7 @@ class EmailProcessor:
             return datetime.now()
     
     def _extract_body_and_attachments(self, email_message) -> tuple:
-        """Extract email body and attachments"""
+        """Extract email body and attachment filename/type/size details"""
         body = ""
         attachments = []
         
@@ -140,31 +1191,29 @@ class EmailProcessor:
                 if "attachment" in content_disposition:
                     filename = part.get_filename()
                     if filename:
-                        attachments.append(self._decode_header(filename))
-                elif content_type == "text/plain" and "attachment" not in content_disposition:
-                    try:
-                        body += part.get_payload(decode=True).decode()
-                    except:
-                        pass
+                        size = getattr(part, "payload_size", None)
+                        if size is None:
+                            payload = part.get_payload(decode=True)
+                            size = len(payload) if isinstance(payload, bytes) else 0
+                        attachments.append({
+                            "filename": self._decode_header(filename),
+                            "content_type": content_type,
+                            "size": size
+                        })
+                elif content_type == "text/plain":
+                    body += decode_text_part(part)
                 elif content_type == "text/html" and not body:
-                    try:
-                        html_body = part.get_payload(decode=True).decode()
-                        body = self._html_to_text(html_body)
-                    except:
-                        pass
-        else:
-            try:
-                body = email_message.get_payload(decode=True).decode()
-            except:
-                body = str(email_message.get_payload())
+                    body = self._html_to_text(decode_text_part(part))
+        elif email_message.get_content_maintype() == "text":
+            body = decode_text_part(email_message)
+            if email_message.get_content_type() == "text/html":
+                body = self._html_to_text(body)
         
         return body.strip(), attachments
     
-    def _html_to_text(self, html: str) -> str:
+    def _html_to_text(self, html: str, max_chars: Optional[int] = None) -> str:
         """Convert HTML to plain text"""
-        text = re.sub('<[^<]+?>', '', html)
-        text = re.sub(r'\s+', ' ', text)
-        return text.strip()
+        return html_to_text(html, max_chars)
     
     def disconnect(self):
         """Disconnect from email server"""
@@ -175,6 +1224,47 @@ class EmailProcessor:
             except:
                 pass
             self.connection = None
+            self.selected_folder = None
+        if self.pool:
+            self.pool.close()
+            self.pool = None
+        if self._parse_executor:
+            self._parse_executor.shutdown()
+            self._parse_executor = None
+
+
+def _decode_header_value(header) -> str:
+    """Decode an RFC 2047 encoded header into text"""
+    decoded_parts = decode_header(header)
+    decoded_string = ""
+    
+    for part, encoding in decoded_parts:
+        if isinstance(part, bytes):
+            try:
+                decoded_string += part.decode(encoding or "utf-8")
+            except:
+                decoded_string += part.decode("utf-8", errors="ignore")
+        else:
+            decoded_string += part
+    
+    return decoded_string
+
+
+@functools.lru_cache(maxsize=HEADER_CACHE_SIZE)
+def _decode_header_cached(header: str) -> str:
+    """Decode a header string, caching results for repeated senders and subjects"""
+    return _decode_header_value(header)
+
+
+def header_cache_info():
+    """Return hit/miss statistics of the header decoding cache in this process"""
+    return _decode_header_cached.cache_info()
+
+
+def _parse_emails_worker(raw_emails: List[tuple]) -> List[Optional[Dict]]:
+    """Parse (UID, raw RFC822 bytes, flags) triples in a worker process"""
+    parser = EmailProcessor()
+    return [parser._parse_email(uid, raw_email, flags) for uid, raw_email, flags in raw_emails]
 
 
 class GmailAPIProcessor:
@@ -182,6 +1272,10 @@ class GmailAPIProcessor:
     
     def __init__(self):
         self.service = None
+        self.credentials = None
+        self.batch_size = GMAIL_BATCH_SIZE
+        self.max_retries = 3
+        self.retry_delay = 1.0
     
     def connect_gmail_api(self, credentials_path: str):
         """Connect to Gmail using API credentials"""
@@ -212,31 +1306,182 @@ class GmailAPIProcessor:
                     pickle.dump(creds, token)
             
             self.service = build('gmail', 'v1', credentials=creds)
+            self.credentials = creds
             return True
         except Exception as e:
             raise Exception(f"Failed to connect to Gmail API: {str(e)}")
     
-    def fetch_emails_api(self, max_results: int = 100, query: str = "") -> List[Dict]:
+    def fetch_emails_api(self, max_results: Optional[int] = 100, query: str = "",
+                         headers_only: bool = False) -> EmailBatch:
         """Fetch emails using Gmail API"""
+        return EmailBatch(self.iter_emails_api(max_results=max_results, query=query, headers_only=headers_only))
+    
+    def iter_emails_api(self, max_results: Optional[int] = 100, query: str = "",
+                        headers_only: bool = False) -> Iterator[Dict]:
+        """Yield emails from the Gmail API, batch_size messages per batch HTTP request
+        
+        Message ids are listed page by page following nextPageToken, so
+        max_results may exceed one page (None fetches every match). Emails
+        are yielded as each batch arrives. With headers_only, messages are
+        requested in metadata format (GMAIL_METADATA_HEADERS plus the snippet)
+        and bodies are left empty until load_body or load_bodies is called.
+        """
         if not self.service:
             raise Exception("Not connected to Gmail API")
         
+        batch_size = max(1, min(self.batch_size, GMAIL_MAX_BATCH_SIZE))
+        
         try:
-            results = self.service.users().messages().list(
-                userId='me', maxResults=max_results, q=query
-            ).execute()
+            for msg_ids in self._iter_message_pages_api(max_results, query):
+                for start in range(0, len(msg_ids), batch_size):
+                    yield from self._fetch_batch_api(msg_ids[start:start + batch_size], headers_only)
+        except Exception as e:
+            raise Exception(f"Failed to fetch emails: {str(e)}")
+    
+    def _iter_message_pages_api(self, max_results: Optional[int], query: str) -> Iterator[List[str]]:
+        """Yield message ids one list page at a time
+        
+        The next page is requested on a background thread, over its own HTTP
+        connection, while the caller fetches the messages of the current one.
+        """
+        http = self._new_http()
+        remaining = max_results
+        
+        def list_page(page_token, page_size):
+            request = self.service.users().messages().list(
+                userId='me', maxResults=page_size, q=query, pageToken=page_token
+            )
+            return request.execute(http=http) if http else request.execute()
+        
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            def request_page(page_token):
+                page_size = GMAIL_LIST_PAGE_SIZE if remaining is None else min(remaining, GMAIL_LIST_PAGE_SIZE)
+                if http:
+                    return executor.submit(list_page, page_token, page_size)
+                future = Future()
+                future.set_result(list_page(page_token, page_size))
+                return future
+            
+            future = request_page(None)
+            while future:
+                results = future.result()
+                msg_ids = [message['id'] for message in results.get('messages', [])]
+                if remaining is not None:
+                    msg_ids = msg_ids[:remaining]
+                    remaining -= len(msg_ids)
+                
+                page_token = results.get('nextPageToken')
+                more = page_token and msg_ids and (remaining is None or remaining > 0)
+                future = request_page(page_token) if more else None
+                
+                if msg_ids:
+                    yield msg_ids
+    
+    def _new_http(self):
+        """Create a separate authorized HTTP client, or None if that is not possible
+        
+        httplib2 connections are not thread-safe, so requests made on another
+        thread need their own.
+        """
+        if self.credentials is None:
+            return None
+        
+        try:
+            import google_auth_httplib2
+            import httplib2
+        except ImportError:
+            return None
+        
+        return google_auth_httplib2.AuthorizedHttp(self.credentials, http=httplib2.Http())
+    
+    def load_body(self, email_data: Dict) -> Dict:
+        """Download the body of a metadata-only email record in place"""
+        return self.load_bodies([email_data])[0]
+    
+    def load_bodies(self, emails: List[Dict]) -> List[Dict]:
+        """Download bodies for all metadata-only records with batched full gets
+        
+        Records are updated in place; for an EmailBatch the updated records are
+        written back into the batch.
+        """
+        if not self.service:
+            raise Exception("Not connected to Gmail API")
+        
+        pending = {}
+        for index, email_data in enumerate(emails):
+            if not email_data.get("body_loaded", True):
+                pending[email_data["id"]] = (index, email_data)
+        
+        batch_size = max(1, min(self.batch_size, GMAIL_MAX_BATCH_SIZE))
+        msg_ids = list(pending)
+        try:
+            for start in range(0, len(msg_ids), batch_size):
+                for full_data in self._fetch_batch_api(msg_ids[start:start + batch_size]):
+                    index, email_data = pending[full_data["id"]]
+                    email_data.update(full_data)
+                    emails[index] = email_data
+        except Exception as e:
+            raise Exception(f"Failed to load email bodies: {str(e)}")
+        
+        return emails
+    
+    def _fetch_batch_api(self, msg_ids: List[str], headers_only: bool = False) -> List[Dict]:
+        """Fetch messages with Gmail batch HTTP requests, in the order given
+        
+        Each message succeeds or fails on its own: rate-limited and server
+        errors are retried in a smaller follow-up batch with backoff, other
+        errors are reported and the message is skipped.
+        """
+        messages = {}
+        pending = list(msg_ids)
+        
+        for attempt in range(self.max_retries + 1):
+            failed = {}
+            
+            def on_message(request_id, response, exception):
+                if exception is None:
+                    messages[request_id] = response
+                else:
+                    failed[request_id] = exception
+            
+            batch = self.service.new_batch_http_request(callback=on_message)
+            for msg_id in pending:
+                if headers_only:
+                    request = self.service.users().messages().get(
+                        userId='me', id=msg_id, format='metadata', metadataHeaders=GMAIL_METADATA_HEADERS
+                    )
+                else:
+                    request = self.service.users().messages().get(userId='me', id=msg_id, format='full')
+                batch.add(request, request_id=msg_id)
+            batch.execute()
             
-            messages = results.get('messages', [])
-            emails = []
+            pending = [msg_id for msg_id, exception in failed.items()
+                       if self._is_retryable_api_error(exception)]
+            for msg_id, exception in failed.items():
+                if msg_id not in pending or attempt == self.max_retries:
+                    print(f"Error processing email {msg_id}: {str(exception)}")
             
-            for message in messages:
-                email_data = self._fetch_email_by_id_api(message['id'])
+            if not pending:
+                break
+            if attempt < self.max_retries:
+                time.sleep(self.retry_delay * 2 ** attempt)
+        
+        emails = []
+        for msg_id in msg_ids:
+            if msg_id in messages:
+                email_data = self._email_from_message_api(msg_id, messages[msg_id], headers_only)
                 if email_data:
                     emails.append(email_data)
-            
-            return emails
-        except Exception as e:
-            raise Exception(f"Failed to fetch emails: {str(e)}")
+        return emails
+    
+    def _is_retryable_api_error(self, exception: Exception) -> bool:
+        """Check whether a failed request was rate-limited or hit a server error"""
+        status = getattr(getattr(exception, "resp", None), "status", None)
+        if status is None:
+            return False
+        if int(status) == 403:
+            return "ratelimitexceeded" in str(exception).lower()
+        return int(status) in GMAIL_RETRY_STATUSES
     
     def _fetch_email_by_id_api(self, msg_id: str) -> Optional[Dict]:
         """Fetch single email using Gmail API"""
@@ -244,22 +1489,30 @@ class GmailAPIProcessor:
             message = self.service.users().messages().get(
                 userId='me', id=msg_id, format='full'
             ).execute()
-            
+        except Exception as e:
+            print(f"Error processing email {msg_id}: {str(e)}")
+            return None
+        
+        return self._email_from_message_api(msg_id, message)
+    
+    def _email_from_message_api(self, msg_id: str, message: Dict, headers_only: bool = False) -> Optional[Dict]:
+        """Build an email record from a Gmail API message resource (full or metadata format)"""
+        try:
             headers = message['payload']['headers']
             subject = next((h['value'] for h in headers if h['name'] == 'Subject'), '')
             from_addr = next((h['value'] for h in headers if h['name'] == 'From'), '')
             to_addr = next((h['value'] for h in headers if h['name'] == 'To'), '')
             date_str = next((h['value'] for h in headers if h['name'] == 'Date'), '')
+            message_id = next((h['value'] for h in headers if h['name'].lower() == 'message-id'), '')
+            in_reply_to = next((h['value'] for h in headers if h['name'].lower() == 'in-reply-to'), '')
+            references = next((h['value'] for h in headers if h['name'].lower() == 'references'), '')
             
             date_obj = email.utils.parsedate_to_datetime(date_str) if date_str else datetime.now()
             
-            body = self._get_body_api(message['payload'])
+            body = "" if headers_only else self._get_body_api(message['payload'])
             
-            attachments = []
-            if 'parts' in message['payload']:
-                for part in message['payload']['parts']:
-                    if part.get('filename'):
-                        attachments.append(part['filename'])
+            attachment_details = [] if headers_only else self._attachment_details_api(message['payload'])
+            attachments = [detail["filename"] for detail in attachment_details]
             
             return {
                 "id": msg_id,
@@ -267,14 +1520,72 @@ class GmailAPIProcessor:
                 "from": from_addr,
                 "to": to_addr,
                 "date": date_obj,
+                "message_id": message_id.strip(),
+                "in_reply_to": in_reply_to.strip(),
+                "references": parse_message_ids(references),
                 "body": body,
                 "attachments": attachments,
-                "has_attachments": len(attachments) > 0
+                "attachment_details": attachment_details,
+                "has_attachments": len(attachments) > 0,
+                "snippet": html.unescape(message.get('snippet', '')),
+                "size": message.get('sizeEstimate', 0),
+                "body_loaded": not headers_only
             }
         except Exception as e:
             print(f"Error processing email {msg_id}: {str(e)}")
             return None
     
+    def save_attachments(self, emails: List[Dict], store: AttachmentStore,
+                         chunk_size: int = 1024 * 1024) -> int:
+        """Download the attachments of the given records into an AttachmentStore
+        
+        The Gmail API returns each attachment whole; its base64url data is
+        decoded in chunk_size pieces. Stored paths are added to each record
+        as attachment_paths. Returns the number of attachments saved.
+        """
+        if not self.service:
+            raise Exception("Not connected to Gmail API")
+        
+        saved = 0
+        try:
+            for index, email_data in enumerate(emails):
+                details = [detail for detail in email_data.get("attachment_details") or []
+                           if detail.get("attachment_id")]
+                if not details:
+                    continue
+                
+                for detail in details:
+                    attachment = self.service.users().messages().attachments().get(
+                        userId='me', messageId=email_data["id"], id=detail["attachment_id"]
+                    ).execute()
+                    data = attachment.get('data', '').encode()
+                    detail["path"] = store.save(
+                        (data[start:start + chunk_size] for start in range(0, len(data), chunk_size)),
+                        detail["filename"], "base64url", detail["content_type"]
+                    )
+                    saved += 1
+                
+                email_data["attachment_paths"] = [detail["path"] for detail in details]
+                emails[index] = email_data
+        except Exception as e:
+            raise Exception(f"Failed to save attachments: {str(e)}")
+        
+        return saved
+    
+    def _attachment_details_api(self, payload) -> List[Dict]:
+        """Describe attachments from Gmail API part metadata, including nested parts"""
+        details = []
+        for part in payload.get('parts', []):
+            if part.get('filename'):
+                details.append({
+                    "filename": part['filename'],
+                    "content_type": part.get('mimeType', ''),
+                    "size": part.get('body', {}).get('size', 0),
+                    "attachment_id": part.get('body', {}).get('attachmentId')
+                })
+            details.extend(self._attachment_details_api(part))
+        return details
+    
     def _get_body_api(self, payload) -> str:
         """Extract body from Gmail API payload"""
         body = ""
@@ -287,8 +1598,8 @@ class GmailAPIProcessor:
                         break
                 elif part['mimeType'] == 'text/html' and not body:
                     if 'data' in part['body']:
-                        html = base64.urlsafe_b64decode(part['body']['data']).decode()
-                        body = re.sub('<[^<]+?>', '', html)
+                        html_body = base64.urlsafe_b64decode(part['body']['data']).decode()
+                        body = html_to_text(html_body)
         elif 'body' in payload and 'data' in payload['body']:
             body = base64.urlsafe_b64decode(payload['body']['data']).decode()
         
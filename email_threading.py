@@ -0,0 +1,174 @@
+import email.utils
+import functools
+import re
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+
+_MESSAGE_ID_RE = re.compile(r'<[^<>\s]+>')
+_SUBJECT_PREFIX_RE = re.compile(r'^(\s*(re|fwd?|aw|sv|wg)\s*(\[\d+\])?\s*:\s*)+', re.IGNORECASE)
+
+
+class _Container:
+    """Node of the thread tree; email is None for messages only known by reference"""
+
+    __slots__ = ("email", "parent", "children")
+
+    def __init__(self):
+        self.email = None
+        self.parent = None
+        self.children = []
+
+
+def parse_message_ids(value) -> List[str]:
+    """Extract '<id@host>' tokens from a Message-ID, In-Reply-To or References value"""
+    if isinstance(value, (list, tuple)):
+        value = " ".join(str(item) for item in value)
+    return _MESSAGE_ID_RE.findall(value or "")
+
+
+def normalize_subject(subject: str) -> str:
+    """Strip reply/forward prefixes and surrounding whitespace from a subject"""
+    return _SUBJECT_PREFIX_RE.sub("", subject or "").strip().lower()
+
+
+def build_threads(emails: Iterable[Dict]) -> List[Dict]:
+    """Group email records into conversations (JWZ threading)
+
+    Messages are linked through a hash table keyed by Message-ID using their
+    References and In-Reply-To headers; conversations whose root is missing
+    are then merged by normalized subject when the later one is a reply.
+    Each thread is a dict with thread_id, subject, messages (oldest first),
+    message_count, participants, first_date and last_date, and threads are
+    ordered by most recent activity.
+    """
+    containers: Dict[str, _Container] = {}
+
+    for index, email_data in enumerate(emails):
+        message_ids = parse_message_ids(email_data.get("message_id"))
+        key = message_ids[0] if message_ids else None
+        container = containers.get(key) if key else None
+        if container is None or container.email is not None:
+            container = _Container()
+            containers[key if key and key not in containers else f"\0{index}"] = container
+        container.email = email_data
+
+        references = parse_message_ids(email_data.get("references"))
+        for reply_to in parse_message_ids(email_data.get("in_reply_to")):
+            if reply_to not in references:
+                references.append(reply_to)
+
+        parent = None
+        for reference in references:
+            reference_container = containers.get(reference)
+            if reference_container is None:
+                reference_container = containers[reference] = _Container()
+            if parent is not None and reference_container.parent is None:
+                _link(parent, reference_container)
+            parent = reference_container
+
+        if parent is not None:
+            _link(parent, container)
+
+    roots = [container for container in containers.values() if container.parent is None]
+    groups = _group_by_subject([(root, _collect(root)) for root in roots])
+
+    threads = [_thread(sorted(messages, key=_date_key)) for messages in groups if messages]
+    threads.sort(key=lambda thread: _date_key({"date": thread["last_date"]}), reverse=True)
+    return threads
+
+
+def _link(parent: _Container, child: _Container):
+    """Make child a child of parent unless that would create a loop"""
+    if child.parent is parent or _is_ancestor(child, parent):
+        return
+    if child.parent is not None:
+        child.parent.children.remove(child)
+    child.parent = parent
+    parent.children.append(child)
+
+
+def _is_ancestor(ancestor: _Container, container: Optional[_Container]) -> bool:
+    """Check whether ancestor is container or one of its parents"""
+    while container is not None:
+        if container is ancestor:
+            return True
+        container = container.parent
+    return False
+
+
+def _collect(root: _Container) -> List[Dict]:
+    """Return every email in a thread tree, without recursion"""
+    messages = []
+    stack = [root]
+    while stack:
+        container = stack.pop()
+        if container.email is not None:
+            messages.append(container.email)
+        stack.extend(container.children)
+    return messages
+
+
+def _group_by_subject(trees: List[tuple]) -> List[List[Dict]]:
+    """Merge root-less replies into the conversation with the same base subject"""
+    groups: List[List[Dict]] = []
+    by_subject: Dict[str, List[Dict]] = {}
+
+    for root, messages in sorted(trees, key=lambda tree: min((_date_key(m) for m in tree[1]), default=0)):
+        if not messages:
+            continue
+
+        first = min(messages, key=_date_key)
+        subject = first.get("subject") or ""
+        base = normalize_subject(subject)
+        is_reply = root.email is None or _SUBJECT_PREFIX_RE.match(subject) is not None
+
+        if base and is_reply and base in by_subject:
+            by_subject[base].extend(messages)
+            continue
+
+        groups.append(messages)
+        if base:
+            by_subject.setdefault(base, messages)
+
+    return groups
+
+
+def _thread(messages: List[Dict]) -> Dict:
+    """Summarize one conversation"""
+    participants = {}
+    for email_data in messages:
+        for field in ("from", "to"):
+            for address, display in _addresses(email_data.get(field) or ""):
+                participants.setdefault(address, display)
+
+    first, last = messages[0], messages[-1]
+    return {
+        "thread_id": first.get("message_id") or first.get("id"),
+        "subject": first.get("subject", ""),
+        "messages": messages,
+        "message_count": len(messages),
+        "participants": list(participants.values()),
+        "first_date": first.get("date"),
+        "last_date": last.get("date")
+    }
+
+
+@functools.lru_cache(maxsize=4096)
+def _addresses(value: str) -> tuple:
+    """Parse an address header into (lower-cased address, display form) pairs"""
+    return tuple(
+        (address.lower(), f"{name} <{address}>" if name else address)
+        for name, address in email.utils.getaddresses([value]) if address
+    )
+
+
+def _date_key(email_data: Dict) -> float:
+    """Sort key for a record's date; records without a date sort first"""
+    date = email_data.get("date")
+    if isinstance(date, datetime):
+        try:
+            return date.timestamp()
+        except (OverflowError, OSError, ValueError):
+            return 0.0
+    return 0.0
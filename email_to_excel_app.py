@@ -1,5 +1,10 @@
 import streamlit as st
 from email_processor import EmailProcessor, GmailAPIProcessor
+from attachment_store import AttachmentStore
+from email_batch import EmailBatch
+from email_cache import EmailCache
+from email_dedup import EmailDeduplicator
+from raw_store import RawMessageStore
 from excel_exporter import ExcelExporter
 import pandas as pd
 from datetime import datetime, timedelta
@@ -17,7 +22,7 @@ st.write("Extract emails from your inbox and export them to Excel format")
 
 
 if 'emails' not in st.session_state:
-    st.session_state.emails = []
+    st.session_state.emails = EmailBatch()
 if 'connected' not in st.session_state:
     st.session_state.connected = False
 if 'processor' not in st.session_state:
@@ -54,13 +59,30 @@ if connection_type == "IMAP (Gmail, Outlook, etc.)":
         help="Gmail: imap.gmail.com, Outlook: outlook.office365.com"
     )
     
+    use_cache = st.sidebar.checkbox(
+        "Cache emails locally",
+        value=False,
+        help="Keep fetched emails, including their bodies, in email_cache.sqlite3 in the app's "
+             "working directory so repeat fetches only download new messages"
+    )
+    
+    keep_raw = st.sidebar.checkbox(
+        "Keep raw messages",
+        value=False,
+        help="Store each downloaded message under raw_messages/ in the app's working directory "
+             "so re-exports can be served without downloading again"
+    )
+    
     if st.sidebar.button("🔌 Connect", type="primary"):
         if not email_address or not password:
             st.sidebar.error("Please enter email and password")
         else:
             try:
                 with st.spinner("Connecting to email server..."):
-                    processor = EmailProcessor()
+                    processor = EmailProcessor(
+                        cache=EmailCache() if use_cache else None,
+                        raw_store=RawMessageStore() if keep_raw else None
+                    )
                     processor.connect_imap(email_address, password, imap_server)
                     st.session_state.processor = processor
                     st.session_state.connected = True
@@ -105,7 +127,7 @@ if st.session_state.connected:
             st.session_state.processor.disconnect()
         st.session_state.connected = False
         st.session_state.processor = None
-        st.session_state.emails = []
+        st.session_state.emails = EmailBatch()
         st.rerun()
 
 
@@ -120,9 +142,15 @@ if st.session_state.connected:
         
         with fetch_col1:
             if connection_type == "IMAP (Gmail, Outlook, etc.)":
+                extra_folders = []
                 try:
                     folders = st.session_state.processor.get_folders()
                     selected_folder = st.selectbox("Select Folder", folders, index=0 if "INBOX" in folders else 0)
+                    extra_folders = st.multiselect(
+                        "Also fetch from",
+                        [f for f in folders if f != selected_folder],
+                        help="Additional folders are fetched in parallel"
+                    )
                 except:
                     selected_folder = st.text_input("Folder Name", value="INBOX")
             else:
@@ -133,7 +161,7 @@ if st.session_state.connected:
             email_limit = st.number_input(
                 "Number of Emails",
                 min_value=1,
-                max_value=1000,
+                max_value=100000,
                 value=50,
                 help="Maximum number of emails to fetch"
             )
@@ -159,14 +187,64 @@ if st.session_state.connected:
             }
             custom_search = search_map.get(search_option, "ALL")
         
+        headers_only = False
+        body_limit = None
+        parallelism = 1
+        if connection_type == "IMAP (Gmail, Outlook, etc.)":
+            option_col1, option_col2 = st.columns(2)
+            with option_col1:
+                download_mode = st.selectbox(
+                    "Download",
+                    ["Full messages", "Text preview (first 2 KB)", "Headers only (fastest)"],
+                    help="Text preview skips attachments; headers only downloads bodies when viewed or exported"
+                )
+                headers_only = download_mode == "Headers only (fastest)"
+                body_limit = 2048 if download_mode == "Text preview (first 2 KB)" else None
+            with option_col2:
+                parallelism = st.slider(
+                    "Parallel connections",
+                    min_value=1,
+                    max_value=st.session_state.processor.max_connections,
+                    value=1,
+                    help="Split large folders into UID ranges fetched over several connections"
+                )
+        else:
+            download_mode = st.selectbox(
+                "Download",
+                ["Full messages", "Metadata and snippet (fastest)"],
+                help="Metadata mode shows Gmail's snippet and downloads bodies when viewed or exported"
+            )
+            headers_only = download_mode == "Metadata and snippet (fastest)"
+        
+        drop_duplicates = st.checkbox(
+            "Drop duplicate messages",
+            value=True,
+            help="Keep one copy of messages with the same Message-ID (or identical headers and body), "
+                 "e.g. when fetching INBOX together with All Mail"
+        )
+        
         if st.button("📨 Fetch Emails", type="primary"):
             try:
                 with st.spinner(f"Fetching emails from {selected_folder}..."):
-                    if connection_type == "IMAP (Gmail, Outlook, etc.)":
+                    deduplicator = EmailDeduplicator() if drop_duplicates else None
+                    multi_folder = connection_type == "IMAP (Gmail, Outlook, etc.)" and bool(extra_folders)
+                    if multi_folder:
+                        emails = st.session_state.processor.fetch_folders(
+                            [selected_folder] + extra_folders,
+                            limit=email_limit,
+                            search_criteria=custom_search,
+                            headers_only=headers_only,
+                            body_limit=body_limit,
+                            deduplicator=deduplicator
+                        )
+                    elif connection_type == "IMAP (Gmail, Outlook, etc.)":
                         emails = st.session_state.processor.fetch_emails(
                             folder=selected_folder,
                             limit=email_limit,
-                            search_criteria=custom_search
+                            search_criteria=custom_search,
+                            headers_only=headers_only,
+                            parallelism=parallelism,
+                            body_limit=body_limit
                         )
                     else:
                         query = ""
@@ -179,11 +257,19 @@ if st.session_state.connected:
                         
                         emails = st.session_state.processor.fetch_emails_api(
                             max_results=email_limit,
-                            query=query
+                            query=query,
+                            headers_only=headers_only
                         )
                     
+                    if deduplicator and not multi_folder:
+                        emails = EmailBatch(deduplicator.filter(emails))
+                    
                     st.session_state.emails = emails
                     st.success(f"✅ Fetched {len(emails)} emails successfully!")
+                    if deduplicator and deduplicator.duplicates:
+                        st.caption(f"Dropped {deduplicator.duplicates} duplicate messages")
+                    if getattr(st.session_state.processor, "compression_ratio", 1.0) > 1.0:
+                        st.caption(f"Transfer compressed {st.session_state.processor.compression_ratio:.1f}x (COMPRESS=DEFLATE)")
             except Exception as e:
                 st.error(f"❌ Error fetching emails: {str(e)}")
                 st.code(traceback.format_exc())
@@ -194,10 +280,10 @@ if st.session_state.connected:
         if st.session_state.emails:
             st.metric("Total Emails", len(st.session_state.emails))
             
-            with_attachments = sum(1 for e in st.session_state.emails if e.get('has_attachments', False))
+            with_attachments = sum(1 for value in st.session_state.emails.column('has_attachments', False) if value)
             st.metric("With Attachments", with_attachments)
             
-            unique_senders = len(set(e.get('from', '') for e in st.session_state.emails))
+            unique_senders = len(set(st.session_state.emails.column('from', '')))
             st.metric("Unique Senders", unique_senders)
         else:
             st.info("No emails fetched yet")
@@ -207,16 +293,16 @@ if st.session_state.connected:
         st.markdown("---")
         st.subheader("📋 Email Preview")
         
-        df = pd.DataFrame([
-            {
-                'Date': e.get('date', ''),
-                'From': e.get('from', ''),
-                'Subject': e.get('subject', ''),
-                'Has Attachments': '✅' if e.get('has_attachments', False) else '❌',
-                'Body Preview': (e.get('body', '')[:100] + '...') if len(e.get('body', '')) > 100 else e.get('body', '')
-            }
-            for e in st.session_state.emails
-        ])
+        emails = st.session_state.emails
+        df = pd.DataFrame({
+            'Date': emails.column('date', ''),
+            'From': emails.column('from', ''),
+            'Subject': emails.column('subject', ''),
+            'Has Attachments': ['✅' if value else '❌' for value in emails.column('has_attachments', False)],
+            'Body Preview': [(body[:100] + '...') if len(body) > 100 else body
+                             for body in (body or snippet for body, snippet
+                                          in zip(emails.column('body', ''), emails.column('snippet', '')))]
+        })
         
         st.dataframe(df, use_container_width=True, height=300)
         
@@ -229,9 +315,15 @@ if st.session_state.connected:
         with export_col1:
             export_format = st.radio(
                 "Export Format",
-                ["Excel (XLSX)", "Excel with Summary", "CSV"],
+                ["Excel (XLSX)", "Excel with Summary", "Excel (one row per thread)", "CSV"],
                 help="Choose export format"
             )
+            save_attachments = st.checkbox(
+                "Save attachments",
+                value=False,
+                help="Download attachments to the 'attachments' folder (identical files are stored once) "
+                     "and list their saved paths in the Attachments column"
+            )
         
         with export_col2:
             filename = st.text_input(
@@ -245,6 +337,18 @@ if st.session_state.connected:
             st.write("")
             if st.button("📥 Export to File", type="primary"):
                 try:
+                    if hasattr(st.session_state.processor, 'load_bodies'):
+                        with st.spinner("Downloading email bodies..."):
+                            st.session_state.processor.load_bodies(st.session_state.emails)
+                    
+                    if save_attachments:
+                        with st.spinner("Saving attachments..."):
+                            store = AttachmentStore()
+                            saved = st.session_state.processor.save_attachments(st.session_state.emails, store)
+                            stats = store.stats()
+                            st.info(f"📎 Saved {saved} attachments ({stats['stored']} new files, "
+                                    f"{stats['duplicates']} duplicates skipped)")
+                    
                     exporter = ExcelExporter()
                     
                     if export_format == "Excel (XLSX)":
@@ -252,6 +356,11 @@ if st.session_state.connected:
                             st.session_state.emails,
                             filename if filename else None
                         )
+                    elif export_format == "Excel (one row per thread)":
+                        output_file = exporter.create_thread_excel(
+                            st.session_state.emails,
+                            filename if filename else None
+                        )
                     elif export_format == "Excel with Summary":
                         output_file = exporter.create_summary_sheet(
                             st.session_state.emails,
@@ -289,6 +398,11 @@ if st.session_state.connected:
         if selected_email_idx is not None:
             email = st.session_state.emails[selected_email_idx]
             
+            if not email.get('body_loaded', True):
+                with st.spinner("Downloading email body..."):
+                    email = st.session_state.processor.load_body(email)
+                    st.session_state.emails[selected_email_idx] = email
+            
             detail_col1, detail_col2 = st.columns(2)
             
             with detail_col1:
@@ -1,15 +1,83 @@
 import pandas as pd
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+from openpyxl.utils import get_column_letter
 from openpyxl.utils.dataframe import dataframe_to_rows
 from datetime import datetime
-from typing import List, Dict
+from typing import Dict, Iterable, List, Optional
+import csv
 import io
+import os
+
+from email_batch import EmailBatch
+from email_threading import build_threads
+
+
+def _naive_date(date):
+    """Drop the timezone of an aware datetime, which Excel cannot store"""
+    if isinstance(date, datetime) and date.tzinfo is not None:
+        return date.replace(tzinfo=None)
+    return date
+
+
+def _attachment_summary(details: Optional[List[Dict]], filenames: List[str]) -> tuple:
+    """Return the attachment count, total size in bytes and distinct MIME types
+    
+    Records without attachment_details (e.g. from an older cache) get a
+    count from their filenames and no size or types.
+    """
+    if details is None:
+        return len(filenames or []), None, ''
+    
+    size = sum(detail.get('size') or 0 for detail in details)
+    types = ', '.join(dict.fromkeys(detail.get('content_type', '') for detail in details))
+    return len(details), size, types
+
+
+_ATTACHMENT_FIELDS = (('attachment_details', None), ('attachments', []))
+
+# Export columns in order: name -> (record fields with their defaults, converter of their values)
+EXPORT_COLUMNS = {
+    'Date': ((('date', ''),), _naive_date),
+    'From': ((('from', ''),), lambda value: value),
+    'To': ((('to', ''),), lambda value: value),
+    'Subject': ((('subject', ''),), lambda value: value),
+    'Body': ((('body', ''),), lambda value: value),
+    'Has Attachments': ((('has_attachments', False),), lambda value: 'Yes' if value else 'No'),
+    'Attachments': ((('attachment_paths', None), ('attachments', [])),
+                    lambda paths, filenames: ', '.join(paths or filenames)),
+    'Attachment Count': (_ATTACHMENT_FIELDS, lambda details, filenames: _attachment_summary(details, filenames)[0]),
+    'Attachments Size': (_ATTACHMENT_FIELDS, lambda details, filenames: _attachment_summary(details, filenames)[1]),
+    'Attachment Types': (_ATTACHMENT_FIELDS, lambda details, filenames: _attachment_summary(details, filenames)[2]),
+}
 
 
 class ExcelExporter:
     """Export email data to Excel format"""
     
+    COLUMN_WIDTHS = {
+        'Date': 20,
+        'From': 30,
+        'To': 30,
+        'Subject': 40,
+        'Body': 60,
+        'Has Attachments': 15,
+        'Attachments': 30,
+        'Attachment Count': 18,
+        'Attachments Size': 18,
+        'Attachment Types': 30
+    }
+    
+    THREAD_COLUMN_WIDTHS = {
+        'Subject': 40,
+        'Messages': 12,
+        'Participants': 50,
+        'First Date': 20,
+        'Last Date': 20,
+        'Thread ID': 40
+    }
+    
     def __init__(self):
         self.workbook = None
         self.worksheet = None
@@ -45,34 +113,169 @@ class ExcelExporter:
         
         return buffer
     
-    def _emails_to_dataframe(self, emails: List[Dict]) -> pd.DataFrame:
-        """Convert email list to pandas DataFrame"""
-        data = []
+    def create_thread_excel(self, emails: List[Dict], filename: str = None) -> str:
+        """Create Excel file with one row per conversation thread"""
+        if not emails:
+            raise ValueError("No emails to export")
         
-        for email_data in emails:
-            row = {
-                'Date': email_data.get('date', ''),
-                'From': email_data.get('from', ''),
-                'To': email_data.get('to', ''),
-                'Subject': email_data.get('subject', ''),
-                'Body': email_data.get('body', ''),
-                'Has Attachments': 'Yes' if email_data.get('has_attachments', False) else 'No',
-                'Attachments': ', '.join(email_data.get('attachments', []))
-            }
-            data.append(row)
+        df = self._threads_to_dataframe(build_threads(emails))
         
-        df = pd.DataFrame(data)
+        if filename is None:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            filename = f"threads_export_{timestamp}.xlsx"
+        
+        if not filename.endswith('.xlsx'):
+            filename += '.xlsx'
+        
+        self._create_formatted_excel(df, filename, title="Threads")
+        
+        return filename
+    
+    def _threads_to_dataframe(self, threads: List[Dict]) -> pd.DataFrame:
+        """Convert threads from build_threads to a DataFrame"""
+        df = pd.DataFrame({
+            'Subject': [thread['subject'] for thread in threads],
+            'Messages': [thread['message_count'] for thread in threads],
+            'Participants': [', '.join(thread['participants']) for thread in threads],
+            'First Date': [_naive_date(thread['first_date']) for thread in threads],
+            'Last Date': [_naive_date(thread['last_date']) for thread in threads],
+            'Thread ID': [thread['thread_id'] for thread in threads]
+        })
+        
+        for column in ('First Date', 'Last Date'):
+            df[column] = pd.to_datetime(df[column], errors='coerce')
+        
+        return df
+    
+    def _emails_to_dataframe(self, emails: List[Dict]) -> pd.DataFrame:
+        """Convert email list to pandas DataFrame"""
+        if isinstance(emails, EmailBatch):
+            df = self._batch_to_dataframe(emails)
+        else:
+            df = pd.DataFrame([self._email_to_row(email_data) for email_data in emails])
         
         if 'Date' in df.columns:
             df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
         
         return df
     
-    def _create_formatted_excel(self, df: pd.DataFrame, output):
+    def _batch_to_dataframe(self, batch: EmailBatch) -> pd.DataFrame:
+        """Build the export DataFrame column by column from an EmailBatch"""
+        columns = {}
+        for name, (fields, convert) in EXPORT_COLUMNS.items():
+            values = zip(*(batch.column(field, default) for field, default in fields))
+            columns[name] = [convert(*args) for args in values]
+        return pd.DataFrame(columns)
+    
+    def _email_to_row(self, email_data: Dict) -> Dict:
+        """Convert one email record to an export row"""
+        return {
+            name: convert(*(email_data.get(field, default) for field, default in fields))
+            for name, (fields, convert) in EXPORT_COLUMNS.items()
+        }
+    
+    def stream_to_excel(self, emails: Iterable[Dict], filename: str = None) -> str:
+        """Write emails to Excel row by row, without holding them all in memory"""
+        if filename is None:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            filename = f"emails_export_{timestamp}.xlsx"
+        
+        if not filename.endswith('.xlsx'):
+            filename += '.xlsx'
+        
+        workbook = Workbook(write_only=True)
+        worksheet = workbook.create_sheet("Emails")
+        worksheet.freeze_panes = "A2"
+        
+        columns = list(self.COLUMN_WIDTHS)
+        for idx, column in enumerate(columns, 1):
+            worksheet.column_dimensions[get_column_letter(idx)].width = self.COLUMN_WIDTHS[column]
+        
+        thin_border = Border(
+            left=Side(style='thin'),
+            right=Side(style='thin'),
+            top=Side(style='thin'),
+            bottom=Side(style='thin')
+        )
+        header_font = Font(bold=True, color="FFFFFF", size=11)
+        header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
+        header_alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
+        body_alignment = Alignment(vertical="top", wrap_text=True)
+        
+        header = []
+        for column in columns:
+            cell = WriteOnlyCell(worksheet, value=column)
+            cell.font = header_font
+            cell.fill = header_fill
+            cell.alignment = header_alignment
+            cell.border = thin_border
+            header.append(cell)
+        worksheet.append(header)
+        
+        count = 0
+        for email_data in emails:
+            row = self._email_to_row(email_data)
+            if row['Body'] and len(str(row['Body'])) > 500:
+                row['Body'] = str(row['Body'])[:500] + "..."
+            
+            cells = []
+            for column in columns:
+                cell = WriteOnlyCell(worksheet, value=row[column])
+                cell.alignment = body_alignment
+                cell.border = thin_border
+                cells.append(cell)
+            worksheet.append(cells)
+            count += 1
+        
+        if count == 0:
+            raise ValueError("No emails to export")
+        
+        workbook.save(filename)
+        
+        return filename
+    
+    def stream_to_csv(self, emails: Iterable[Dict], filename: str = None) -> str:
+        """Write emails to CSV row by row, without holding them all in memory"""
+        if filename is None:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            filename = f"emails_export_{timestamp}.csv"
+        
+        if not filename.endswith('.csv'):
+            filename += '.csv'
+        
+        count = 0
+        with open(filename, 'w', newline='', encoding='utf-8-sig') as f:
+            writer = csv.DictWriter(f, fieldnames=list(self.COLUMN_WIDTHS))
+            writer.writeheader()
+            for email_data in emails:
+                writer.writerow(self._email_to_row(email_data))
+                count += 1
+        
+        if count == 0:
+            raise ValueError("No emails to export")
+        
+        return filename
+    
+    def append_to_csv(self, emails: Iterable[Dict], filename: str) -> str:
+        """Append emails to a CSV file, writing the header if the file is new"""
+        if not filename.endswith('.csv'):
+            filename += '.csv'
+        
+        is_new = not os.path.exists(filename) or os.path.getsize(filename) == 0
+        with open(filename, 'a', newline='', encoding='utf-8-sig' if is_new else 'utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=list(self.COLUMN_WIDTHS))
+            if is_new:
+                writer.writeheader()
+            for email_data in emails:
+                writer.writerow(self._email_to_row(email_data))
+        
+        return filename
+    
+    def _create_formatted_excel(self, df: pd.DataFrame, output, title: str = "Emails"):
         """Create formatted Excel file with styling"""
         self.workbook = Workbook()
         self.worksheet = self.workbook.active
-        self.worksheet.title = "Emails"
+        self.worksheet.title = title
         
         for r_idx, row in enumerate(dataframe_to_rows(df, index=False, header=True), 1):
             for c_idx, value in enumerate(row, 1):
@@ -104,19 +307,9 @@ class ExcelExporter:
     
     def _adjust_column_widths(self, df: pd.DataFrame):
         """Adjust column widths based on content"""
-        column_widths = {
-            'Date': 20,
-            'From': 30,
-            'To': 30,
-            'Subject': 40,
-            'Body': 60,
-            'Has Attachments': 15,
-            'Attachments': 30
-        }
-        
         for idx, column in enumerate(df.columns, 1):
             column_letter = self.worksheet.cell(row=1, column=idx).column_letter
-            width = column_widths.get(column, 15)
+            width = self.COLUMN_WIDTHS.get(column) or self.THREAD_COLUMN_WIDTHS.get(column, 15)
             self.worksheet.column_dimensions[column_letter].width = width
         
         for row in self.worksheet.iter_rows(min_row=2, max_row=self.worksheet.max_row):
@@ -0,0 +1,129 @@
+import re
+from html.parser import HTMLParser
+from typing import List, Optional
+
+
+_CHUNK_SIZE = 64 * 1024
+
+_HIDDEN_TAGS = {"script", "style", "title", "noscript", "template", "object", "iframe"}
+_VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta",
+              "param", "source", "track", "wbr"}
+_PARAGRAPH_TAGS = {"p", "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "table", "ul", "ol",
+                   "pre", "hr", "section", "article", "header", "footer"}
+_LINE_TAGS = {"br", "div", "li", "tr", "dd", "dt", "option", "address"}
+_CELL_TAGS = {"td", "th"}
+# Open elements implicitly closed by a start tag, and the containers that stop it
+_IMPLIED_END = {
+    "p": {"p"}, "li": {"li"}, "option": {"option"},
+    "dt": {"dt", "dd"}, "dd": {"dt", "dd"},
+    "tr": {"tr", "td", "th"}, "td": {"td", "th"}, "th": {"td", "th"},
+}
+_IMPLIED_END_SCOPES = {"table", "ul", "ol", "dl", "select"}
+_HIDDEN_STYLE_RE = re.compile(r'display\s*:\s*none|visibility\s*:\s*hidden', re.IGNORECASE)
+
+
+class _TextExtractor(HTMLParser):
+    """Collect the visible text of an HTML document in a single pass"""
+
+    def __init__(self, max_chars: Optional[int] = None):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.parts: List[str] = []
+        self.length = 0
+        self.done = False
+        self._skip_tag = None
+        self._skip_open: List[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        if self._skip_tag:
+            closes = _IMPLIED_END.get(tag, ())
+            if self._skip_tag in closes and not _IMPLIED_END_SCOPES.intersection(self._skip_open):
+                # A sibling, row or cell start implicitly closes the hidden element
+                self._skip_tag = None
+                self._skip_open = []
+            else:
+                while self._skip_open and self._skip_open[-1] in closes:
+                    self._skip_open.pop()
+                if tag not in _VOID_TAGS:
+                    self._skip_open.append(tag)
+                return
+
+        if tag not in _VOID_TAGS and (tag in _HIDDEN_TAGS or self._is_hidden(attrs)):
+            self._skip_tag = tag
+            self._skip_open = []
+            return
+
+        self._break(tag)
+
+    def handle_endtag(self, tag):
+        if self._skip_tag:
+            if tag in self._skip_open:
+                index = len(self._skip_open) - 1 - self._skip_open[::-1].index(tag)
+                del self._skip_open[index:]
+                return
+
+            parent_closed = tag != self._skip_tag
+            self._skip_tag = None
+            if not parent_closed:
+                return
+
+        if tag != "br" and tag not in _CELL_TAGS:
+            self._break(tag)
+
+    def handle_data(self, data):
+        if self._skip_tag or self.done:
+            return
+
+        text = re.sub(r'\s+', ' ', data)
+        if text.strip() or (self.parts and not self.parts[-1].endswith((" ", "\n"))):
+            self.parts.append(text)
+            self.length += len(text)
+            if self.max_chars and self.length >= self.max_chars:
+                self.done = True
+
+    def _break(self, tag: str):
+        """Record the line or paragraph break implied by a block-level tag"""
+        if tag in _PARAGRAPH_TAGS:
+            self.parts.append("\n\n")
+        elif tag in _LINE_TAGS:
+            self.parts.append("\n")
+        elif tag in _CELL_TAGS:
+            self.parts.append(" ")
+
+    def _is_hidden(self, attrs) -> bool:
+        """Check whether an element is hidden by attribute or inline style"""
+        for name, value in attrs:
+            if name == "hidden" or (name == "aria-hidden" and value == "true"):
+                return True
+            if name == "style" and value and _HIDDEN_STYLE_RE.search(value):
+                return True
+        return False
+
+
+def html_to_text(html: str, max_chars: Optional[int] = None) -> str:
+    """Convert HTML to plain text, keeping paragraph breaks
+
+    Scripts, styles and elements hidden with display:none are dropped and
+    entities are decoded. With max_chars, parsing stops once that much text
+    has been collected, so large documents are not parsed to the end.
+    """
+    if not html:
+        return ""
+
+    parser = _TextExtractor(max_chars)
+    for start in range(0, len(html), _CHUNK_SIZE):
+        parser.feed(html[start:start + _CHUNK_SIZE])
+        if parser.done:
+            break
+    else:
+        parser.close()
+
+    text = "".join(parser.parts)
+    text = re.sub(r' {2,}', ' ', text)
+    text = re.sub(r' *\n *', '\n', text)
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    text = text.strip()
+
+    if max_chars:
+        text = text[:max_chars].rstrip()
+    return text
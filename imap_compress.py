@@ -0,0 +1,108 @@
+import imaplib
+import zlib
+
+
+imaplib.Commands.setdefault("COMPRESS", ("AUTH", "SELECTED"))
+
+
+class CompressedIMAP4_SSL(imaplib.IMAP4_SSL):
+    """IMAP4_SSL connection that can switch to COMPRESS=DEFLATE (RFC 4978)
+
+    After compress() succeeds, everything sent and received is run through
+    raw deflate streams. Byte counters record traffic before and after
+    compression so the effective ratio can be reported.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.compressed = False
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.wire_bytes_sent = 0
+        self.wire_bytes_received = 0
+        self._compressor = None
+        self._decompressor = None
+        self._buffer = bytearray()
+        imaplib.IMAP4_SSL.__init__(self, *args, **kwargs)
+
+    @property
+    def compression_ratio(self) -> float:
+        """Ratio of received data to bytes read from the wire (1.0 when uncompressed)"""
+        if not self.wire_bytes_received:
+            return 1.0
+        return self.bytes_received / self.wire_bytes_received
+
+    def compress(self, level: int = 6) -> bool:
+        """Negotiate COMPRESS=DEFLATE, returning True if the stream is now compressed"""
+        if self.compressed:
+            return True
+        if "COMPRESS=DEFLATE" not in self.capabilities:
+            return False
+
+        typ, _ = self._simple_command("COMPRESS", "DEFLATE")
+        if typ != "OK":
+            return False
+
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        self._decompressor = zlib.decompressobj(-15)
+        self.compressed = True
+        return True
+
+    def pending_bytes(self) -> int:
+        """Number of decompressed bytes buffered but not yet read"""
+        return len(self._buffer)
+
+    def read(self, size):
+        """Read 'size' bytes from remote."""
+        if not self.compressed:
+            data = imaplib.IMAP4_SSL.read(self, size)
+            self._count_received(data, len(data))
+            return data
+
+        while len(self._buffer) < size:
+            self._fill()
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def readline(self):
+        """Read line from remote."""
+        if not self.compressed:
+            line = imaplib.IMAP4_SSL.readline(self)
+            self._count_received(line, len(line))
+            return line
+
+        while True:
+            end = self._buffer.find(b"\n") + 1
+            if end:
+                break
+            if len(self._buffer) > imaplib._MAXLINE:
+                raise self.error("got more than %d bytes" % imaplib._MAXLINE)
+            self._fill()
+
+        if end > imaplib._MAXLINE + 1:
+            raise self.error("got more than %d bytes" % imaplib._MAXLINE)
+        line = bytes(self._buffer[:end])
+        del self._buffer[:end]
+        return line
+
+    def send(self, data):
+        """Send data to remote."""
+        self.bytes_sent += len(data)
+        if self.compressed:
+            data = self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.wire_bytes_sent += len(data)
+        imaplib.IMAP4_SSL.send(self, data)
+
+    def _fill(self):
+        """Read the next chunk from the socket and decompress it into the buffer"""
+        chunk = self.file.read1(65536)
+        if not chunk:
+            raise self.abort("socket error: EOF")
+        data = self._decompressor.decompress(chunk)
+        self._count_received(data, len(chunk))
+        self._buffer += data
+
+    def _count_received(self, data: bytes, wire_size: int):
+        """Update the received byte counters"""
+        self.bytes_received += len(data)
+        self.wire_bytes_received += wire_size
@@ -0,0 +1,71 @@
+import threading
+from contextlib import contextmanager
+from typing import Callable, List
+
+
+class IMAPConnectionPool:
+    """Thread-safe pool of authenticated IMAP connections to one server"""
+
+    def __init__(self, factory: Callable, max_connections: int = 4):
+        if max_connections < 1:
+            raise ValueError("max_connections must be at least 1")
+
+        self.factory = factory
+        self.max_connections = max_connections
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._lock = threading.Lock()
+        self._idle: List = []
+        self._closed = False
+
+    def acquire(self):
+        """Take an idle connection or open a new one, blocking at the cap"""
+        self._slots.acquire()
+        try:
+            with self._lock:
+                if self._closed:
+                    raise Exception("Connection pool is closed")
+                if self._idle:
+                    return self._idle.pop()
+            return self.factory()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, connection, discard: bool = False):
+        """Return a connection to the pool, or log it out when discarded"""
+        try:
+            with self._lock:
+                if not discard and not self._closed:
+                    self._idle.append(connection)
+                    return
+            self._logout(connection)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a with-block"""
+        conn = self.acquire()
+        try:
+            yield conn
+        except Exception:
+            self.release(conn, discard=True)
+            raise
+        else:
+            self.release(conn)
+
+    def close(self):
+        """Log out all idle connections and refuse new acquisitions"""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+
+        for conn in idle:
+            self._logout(conn)
+
+    def _logout(self, connection):
+        """Close a connection, ignoring errors from dead sockets"""
+        try:
+            connection.logout()
+        except Exception:
+            pass
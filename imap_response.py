@@ -0,0 +1,267 @@
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+_LITERAL_RE = re.compile(rb'\{(\d+)\}\r?\n?$')
+
+
+class _Literal(bytes):
+    """Raw literal payload taken from an imaplib response tuple"""
+
+
+_OPEN = object()
+_CLOSE = object()
+
+
+def uid_set(uids: Iterable) -> str:
+    """Compress a list of UIDs into an IMAP sequence set like '1:5,9,12:14'"""
+    numbers = sorted({int(uid) for uid in uids})
+    ranges = []
+
+    for number in numbers:
+        if ranges and number == ranges[-1][1] + 1:
+            ranges[-1][1] = number
+        else:
+            ranges.append([number, number])
+
+    return ",".join(str(a) if a == b else f"{a}:{b}" for a, b in ranges)
+
+
+def parse_esearch(data: bytes) -> Dict[str, str]:
+    """Parse an ESEARCH (RFC 4731) response into its MIN/MAX/COUNT/ALL values"""
+    if isinstance(data, bytes):
+        data = data.decode("ascii", errors="replace")
+
+    tokens = re.sub(r'^\(TAG "[^"]*"\)\s*', '', data or "").split()
+    result = {}
+    for i, token in enumerate(tokens):
+        if token.upper() in ("MIN", "MAX", "COUNT", "ALL") and i + 1 < len(tokens):
+            result[token.upper()] = tokens[i + 1]
+    return result
+
+
+def sequence_set_ranges(sequence_set: str) -> List[Tuple[int, int]]:
+    """Split a sequence set like '1:3,7' into (low, high) ranges"""
+    ranges = []
+    for part in (sequence_set or "").split(","):
+        if not part:
+            continue
+        low, _, high = part.partition(":")
+        low, high = sorted((int(low), int(high or low)))
+        ranges.append((low, high))
+    return ranges
+
+
+def expand_sequence_set(sequence_set: str) -> List[bytes]:
+    """Expand a sequence set like '1:3,7' into UIDs"""
+    return [str(uid).encode() for low, high in sequence_set_ranges(sequence_set)
+            for uid in range(low, high + 1)]
+
+
+def tail_of_sequence_set(sequence_set: str, count: int) -> List[bytes]:
+    """Return the last count UIDs of a sequence set without expanding all of it"""
+    tail = []
+    for low, high in reversed(sequence_set_ranges(sequence_set)):
+        start = max(low, high - (count - len(tail)) + 1)
+        tail[:0] = [str(uid).encode() for uid in range(start, high + 1)]
+        if len(tail) >= count:
+            break
+    return tail
+
+
+def parse_fetch_response(data: List) -> List[Tuple[int, Dict[str, object]]]:
+    """Parse the data returned by imaplib FETCH into (sequence number, items) pairs
+
+    Item names are upper-cased (e.g. 'UID', 'BODY[]', 'ENVELOPE'). Atoms and
+    quoted strings become str, literals become bytes, NIL becomes None and
+    parenthesized lists become Python lists.
+    """
+    segments = []
+    for entry in data:
+        if entry is None:
+            continue
+        if isinstance(entry, tuple):
+            header, literal = entry
+            segments.append(_LITERAL_RE.sub(b'', header))
+            segments.append(_Literal(literal))
+        else:
+            segments.append(entry)
+
+    values = _parse_tokens(_tokenize(segments))
+
+    messages = []
+    for i in range(0, len(values) - 1, 2):
+        seq, items = values[i], values[i + 1]
+        if not isinstance(items, list) or not str(seq).isdigit():
+            continue
+
+        item_map = {}
+        for j in range(0, len(items) - 1, 2):
+            item_map[str(items[j]).upper()] = items[j + 1]
+        messages.append((int(seq), item_map))
+
+    return messages
+
+
+def parse_envelope(envelope: List) -> Dict[str, str]:
+    """Map an ENVELOPE list to its date, subject, address and Message-ID fields"""
+    envelope = list(envelope or []) + [None] * 10
+    fields = ["date", "subject", "from", "sender", "reply_to", "to", "cc", "bcc",
+              "in_reply_to", "message_id"]
+
+    result = {}
+    for index, name in enumerate(fields):
+        value = envelope[index]
+        if isinstance(value, list):
+            result[name] = ", ".join(_format_address(address) for address in value
+                                     if isinstance(address, list))
+        else:
+            result[name] = _as_text(value)
+
+    return result
+
+
+def parse_bodystructure(structure: List, section: str = "") -> List[Dict]:
+    """Flatten a BODYSTRUCTURE into leaf parts with their IMAP section numbers
+
+    Each part is a dict with section, type, params, encoding, size,
+    disposition and filename. Attached messages (message/rfc822) are kept as
+    single leaves rather than descended into.
+    """
+    if not isinstance(structure, list) or not structure:
+        return []
+
+    if isinstance(structure[0], list):
+        parts = []
+        index = 0
+        for child in structure:
+            if not isinstance(child, list):
+                break
+            index += 1
+            child_section = f"{section}.{index}" if section else str(index)
+            parts.extend(parse_bodystructure(child, child_section))
+        return parts
+
+    fields = list(structure) + [None] * 12
+    main_type = (_as_text(fields[0]) or "").lower()
+    sub_type = (_as_text(fields[1]) or "").lower()
+    params = _as_params(fields[2])
+
+    if main_type == "text":
+        extension = fields[8:]
+    elif main_type == "message" and sub_type == "rfc822":
+        extension = fields[10:]
+    else:
+        extension = fields[7:]
+
+    disposition_type = ""
+    disposition_params = {}
+    if len(extension) > 1 and isinstance(extension[1], list) and extension[1]:
+        disposition_type = (_as_text(extension[1][0]) or "").lower()
+        if len(extension[1]) > 1:
+            disposition_params = _as_params(extension[1][1])
+
+    size = _as_text(fields[6])
+
+    return [{
+        "section": section or "1",
+        "type": f"{main_type}/{sub_type}",
+        "params": params,
+        "encoding": (_as_text(fields[5]) or "7bit").lower(),
+        "size": int(size) if size and size.isdigit() else 0,
+        "disposition": disposition_type,
+        "filename": disposition_params.get("filename") or params.get("name") or ""
+    }]
+
+
+def _format_address(address: List) -> str:
+    """Format an ENVELOPE address structure as 'Name <mailbox@host>'"""
+    address = list(address) + [None] * 4
+    name, _, mailbox, host = (_as_text(value) for value in address[:4])
+
+    if mailbox and host:
+        addr_spec = f"{mailbox}@{host}"
+    else:
+        addr_spec = mailbox or ""
+
+    if name:
+        return f"{name} <{addr_spec}>"
+    return addr_spec
+
+
+def _as_params(values) -> Dict[str, str]:
+    """Convert a parenthesized key/value list into a lower-cased dict"""
+    if not isinstance(values, list):
+        return {}
+    return {(_as_text(values[i]) or "").lower(): _as_text(values[i + 1]) or ""
+            for i in range(0, len(values) - 1, 2)}
+
+
+def _as_text(value) -> Optional[str]:
+    """Return response values as text, decoding literals"""
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    return value
+
+
+def _tokenize(segments: List[bytes]):
+    """Split response segments into atoms, strings, literals and parentheses"""
+    for segment in segments:
+        if isinstance(segment, _Literal):
+            yield bytes(segment)
+            continue
+
+        i = 0
+        length = len(segment)
+        while i < length:
+            char = segment[i:i + 1]
+
+            if char in (b' ', b'\r', b'\n'):
+                i += 1
+            elif char in (b'(', b')'):
+                yield _OPEN if char == b'(' else _CLOSE
+                i += 1
+            elif char == b'"':
+                i += 1
+                value = bytearray()
+                while i < length and segment[i:i + 1] != b'"':
+                    if segment[i:i + 1] == b'\\':
+                        i += 1
+                    value += segment[i:i + 1]
+                    i += 1
+                i += 1
+                yield value.decode("utf-8", errors="replace")
+            else:
+                start = i
+                depth = 0
+                while i < length:
+                    char = segment[i:i + 1]
+                    if char == b'[':
+                        depth += 1
+                    elif char == b']':
+                        depth -= 1
+                    elif depth <= 0 and char in (b' ', b'(', b')', b'\r', b'\n'):
+                        break
+                    i += 1
+                atom = segment[start:i].decode("utf-8", errors="replace")
+                yield None if atom.upper() == "NIL" else atom
+
+
+def _parse_tokens(tokens) -> List:
+    """Build nested lists from a token stream"""
+    stack = [[]]
+    for token in tokens:
+        if token is _OPEN:
+            stack.append([])
+        elif token is _CLOSE:
+            if len(stack) > 1:
+                finished = stack.pop()
+                stack[-1].append(finished)
+        else:
+            stack[-1].append(token)
+
+    while len(stack) > 1:
+        finished = stack.pop()
+        stack[-1].append(finished)
+
+    return stack[0]
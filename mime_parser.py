@@ -0,0 +1,59 @@
+from email.feedparser import BytesFeedParser
+from email.message import Message
+from typing import Optional
+
+
+class LeanMessage(Message):
+    """Message whose attachment and non-text payloads are dropped while parsing
+
+    Headers of every part are kept, so filenames and content types remain
+    available; the dropped payload's decoded size is kept in payload_size.
+    """
+
+    payload_size: Optional[int] = None
+
+    def set_payload(self, payload, charset=None):
+        if isinstance(payload, str) and payload and not self._keeps_payload():
+            self.payload_size = _decoded_size(payload, self.get("Content-Transfer-Encoding", ""))
+            payload = ""
+        super().set_payload(payload, charset)
+
+    def _keeps_payload(self) -> bool:
+        """Only inline text parts and containers keep their payload"""
+        main_type = self.get_content_maintype()
+        if main_type in ("multipart", "message"):
+            return True
+        return main_type == "text" and "attachment" not in str(self.get("Content-Disposition", "")).lower()
+
+
+def parse_message(raw_email: bytes, chunk_size: int = 64 * 1024) -> LeanMessage:
+    """Parse raw RFC822 bytes, keeping text bodies and attachment headers only"""
+    parser = BytesFeedParser(_factory=LeanMessage)
+    view = memoryview(raw_email)
+    for start in range(0, len(view), chunk_size):
+        parser.feed(view[start:start + chunk_size].tobytes())
+    return parser.close()
+
+
+def decode_text_part(part: Message) -> str:
+    """Decode a text part's payload using its declared charset"""
+    payload = part.get_payload(decode=True)
+    if not isinstance(payload, bytes):
+        return ""
+
+    charset = part.get_content_charset() or "utf-8"
+    try:
+        return payload.decode(charset, errors="replace")
+    except LookupError:
+        return payload.decode("utf-8", errors="replace")
+
+
+def _decoded_size(payload: str, encoding: str) -> int:
+    """Size of a payload once its transfer encoding is removed"""
+    encoding = str(encoding).strip().lower()
+    if encoding != "base64":
+        return len(payload)
+
+    length = len(payload) - sum(payload.count(char) for char in "\r\n\t ")
+    padding = len(payload.rstrip()) - len(payload.rstrip().rstrip("="))
+    return max(length * 3 // 4 - padding, 0)
@@ -0,0 +1,155 @@
+import hashlib
+import mmap
+import os
+import sqlite3
+import tempfile
+import threading
+import zlib
+from email.parser import BytesHeaderParser
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+
+class RawMessageStore:
+    """Content-addressed on-disk store of raw RFC822 messages
+
+    Each message is written once, zlib-compressed, to objects/<aa>/<sha256>
+    (staged in tmp/ and renamed into place, as in Maildir). A SQLite index
+    maps Message-IDs and (account, folder, UIDVALIDITY, UID) locations to
+    content hashes, so messages can be re-parsed without refetching them.
+    """
+
+    def __init__(self, root: str = "raw_messages", level: int = 6):
+        self.root = root
+        self.level = level
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        os.makedirs(os.path.join(root, "tmp"), exist_ok=True)
+
+        self._db = sqlite3.connect(os.path.join(root, "index.sqlite3"), check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS messages (
+                sha256 TEXT PRIMARY KEY,
+                message_id TEXT,
+                size INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS messages_message_id ON messages (message_id);
+            CREATE TABLE IF NOT EXISTS locations (
+                account TEXT NOT NULL,
+                folder TEXT NOT NULL,
+                uidvalidity INTEGER NOT NULL,
+                uid INTEGER NOT NULL,
+                sha256 TEXT NOT NULL,
+                PRIMARY KEY (account, folder, uidvalidity, uid)
+            );
+        """)
+        self._db.commit()
+
+    def put(self, raw_email: bytes, account: Optional[str] = None, folder: Optional[str] = None,
+            uidvalidity: Optional[int] = None, uid=None) -> str:
+        """Store a message (once) and optionally record its mailbox location, returning its hash"""
+        digest = hashlib.sha256(raw_email).hexdigest()
+        path = self._path(digest)
+
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.root, "tmp"))
+            with os.fdopen(fd, "wb") as f:
+                f.write(zlib.compress(raw_email, self.level))
+            os.replace(tmp_path, path)
+
+        with self._lock:
+            self._db.execute(
+                "INSERT OR IGNORE INTO messages (sha256, message_id, size) VALUES (?, ?, ?)",
+                (digest, self._message_id(raw_email), len(raw_email))
+            )
+            if account is not None and uid is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO locations (account, folder, uidvalidity, uid, sha256) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (account, folder, uidvalidity or 0, int(uid), digest)
+                )
+            self._db.commit()
+
+        return digest
+
+    def get(self, digest: str) -> Optional[bytes]:
+        """Read and decompress a stored message by content hash"""
+        try:
+            with open(self._path(digest), "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    return zlib.decompress(data)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def get_by_message_id(self, message_id: str) -> Optional[bytes]:
+        """Read a stored message by its Message-ID header"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT sha256 FROM messages WHERE message_id = ? LIMIT 1", (message_id.strip(),)
+            ).fetchone()
+        return self.get(row[0]) if row else None
+
+    def get_uids(self, account: str, folder: str, uidvalidity: int, uids: Iterable) -> Dict[str, bytes]:
+        """Read stored messages for the given UIDs, keyed by UID string"""
+        uids = [int(uid) for uid in uids]
+        digests = {}
+
+        with self._lock:
+            for start in range(0, len(uids), 500):
+                chunk = uids[start:start + 500]
+                rows = self._db.execute(
+                    f"SELECT uid, sha256 FROM locations WHERE account = ? AND folder = ? "
+                    f"AND uidvalidity = ? AND uid IN ({','.join('?' * len(chunk))})",
+                    [account, folder, uidvalidity or 0] + chunk
+                ).fetchall()
+                digests.update((str(uid), digest) for uid, digest in rows)
+
+        messages = {}
+        for uid, digest in digests.items():
+            raw_email = self.get(digest)
+            if raw_email is not None:
+                messages[uid] = raw_email
+        return messages
+
+    def iter_messages(self, account: Optional[str] = None,
+                      folder: Optional[str] = None) -> Iterator[Tuple[Dict, bytes]]:
+        """Yield (location, raw bytes) for stored messages, optionally for one account/folder"""
+        query = "SELECT account, folder, uidvalidity, uid, sha256 FROM locations"
+        conditions, params = [], []
+        if account is not None:
+            conditions.append("account = ?")
+            params.append(account)
+        if folder is not None:
+            conditions.append("folder = ?")
+            params.append(folder)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY account, folder, uidvalidity, uid"
+
+        with self._lock:
+            rows = self._db.execute(query, params).fetchall()
+
+        for account_name, folder_name, uidvalidity, uid, digest in rows:
+            raw_email = self.get(digest)
+            if raw_email is not None:
+                location = {"account": account_name, "folder": folder_name,
+                            "uidvalidity": uidvalidity, "uid": str(uid), "sha256": digest}
+                yield location, raw_email
+
+    def close(self):
+        """Close the index database"""
+        with self._lock:
+            self._db.close()
+
+    def _path(self, digest: str) -> str:
+        """Return the object path for a content hash"""
+        return os.path.join(self.root, "objects", digest[:2], digest)
+
+    def _message_id(self, raw_email: bytes) -> Optional[str]:
+        """Extract the Message-ID header from a raw message"""
+        end = raw_email.find(b"\r\n\r\n")
+        if end == -1:
+            end = raw_email.find(b"\n\n")
+        headers = BytesHeaderParser().parsebytes(raw_email[:end] if end != -1 else raw_email)
+        message_id = headers.get("Message-ID")
+        return str(message_id).strip() if message_id else None
@@ -5,8 +5,307 @@ This script tests the core functionality without requiring actual email credenti
 
 from email_processor import EmailProcessor, GmailAPIProcessor
 from excel_exporter import ExcelExporter
+from imap_response import uid_set
+from contextlib import contextmanager
 from datetime import datetime
 import os
+import re
+import threading
+
+
+class FakeIMAPConnection:
+    """In-memory stand-in for an imaplib connection to one folder
+    
+    messages maps UID to (flags, modseq); expunged maps UID to the MODSEQ at
+    which it was removed. Supports SELECT, UID SEARCH (ALL, UNSEEN, n:*,
+    UID n:*) with RETURN (COUNT ALL) when ESEARCH is advertised,
+    UID FETCH (UID FLAGS) with CHANGEDSINCE/VANISHED, UID FETCH of
+    BODY.PEEK[] (see raw_message), BODYSTRUCTURE and ranged
+    BODY.PEEK[section]<offset.size>, and records every UID command it
+    receives. attachments maps UID to (filename, base64 data) parts served
+    as sections 2, 3, ... after a text part.
+    """
+    
+    def __init__(self, messages, uidvalidity=1, capabilities=("IMAP4REV1",), expunged=None,
+                 attachments=None):
+        self.messages = dict(messages)
+        self.expunged = dict(expunged or {})
+        self.attachments = dict(attachments or {})
+        self.uidvalidity = uidvalidity
+        self.capabilities = capabilities
+        self.commands = []
+        self._responses = {}
+    
+    def select(self, folder, readonly=False):
+        highest_modseq = max([modseq for _, modseq in self.messages.values()] + list(self.expunged.values()) + [0])
+        self._responses = {
+            "UIDVALIDITY": [str(self.uidvalidity).encode()],
+            "HIGHESTMODSEQ": [str(highest_modseq).encode() if "CONDSTORE" in self.capabilities else None]
+        }
+        return "OK", [str(len(self.messages)).encode()]
+    
+    def response(self, code):
+        return code, self._responses.pop(code, [None])
+    
+    def uid(self, command, *args):
+        self.commands.append((command,) + args)
+        if command == "SEARCH" and args[0].startswith("RETURN ("):
+            options = args[0][len("RETURN ("):-1].split()
+            uids = self._search(args[1])
+            result = '(TAG "A1") UID'
+            if "COUNT" in options:
+                result += f" COUNT {len(uids)}"
+            if "ALL" in options and uids:
+                result += " ALL " + uid_set([str(uid).encode() for uid in uids])
+            self._responses["ESEARCH"] = [result.encode()]
+            return "OK", [None]
+        if command == "SEARCH":
+            return "OK", [" ".join(str(uid) for uid in self._search(args[0])).encode()]
+        
+        wanted = set(self.messages) if args[0] == "1:*" else {
+            uid for part in args[0].split(",")
+            for uid in range(int(part.split(":")[0]), int(part.split(":")[-1]) + 1)
+        }
+        since = int(args[2].split()[1].strip("()")) if len(args) > 2 else 0
+        if len(args) > 2 and "VANISHED" in args[2]:
+            vanished = [str(uid) for uid, modseq in sorted(self.expunged.items()) if modseq > since]
+            self._responses["VANISHED"] = [("(EARLIER) " + ",".join(vanished)).encode()] if vanished else [None]
+        
+        data = []
+        for seq, uid in enumerate(sorted(self.messages), 1):
+            flags, modseq = self.messages[uid]
+            if uid not in wanted or modseq <= since:
+                continue
+            section = re.match(r'\(UID BODY\.PEEK\[(\d+)\]<(\d+)\.(\d+)>\)', args[1])
+            if "BODY.PEEK[]" in args[1]:
+                raw = self.raw_message(uid)
+                data.append((f"{seq} (UID {uid} FLAGS ({' '.join(flags)}) BODY[] {{{len(raw)}}}".encode(), raw))
+                data.append(b")")
+            elif section:
+                part, offset, size = (int(value) for value in section.groups())
+                chunk = self.attachments[uid][part - 2][1][offset:offset + size]
+                data.append((f"{seq} (UID {uid} BODY[{part}]<{offset}> {{{len(chunk)}}}".encode(), chunk))
+                data.append(b")")
+            elif "BODYSTRUCTURE" in args[1]:
+                data.append(f"{seq} (UID {uid} BODYSTRUCTURE {self.bodystructure(uid)})".encode())
+            else:
+                data.append(f"{seq} (UID {uid} FLAGS ({' '.join(flags)}))".encode())
+        return "OK", data
+    
+    def _search(self, criteria):
+        """Return the UIDs matching a search criteria in ascending order"""
+        uids = sorted(self.messages)
+        if criteria == "UNSEEN":
+            return [uid for uid in uids if "\\Seen" not in self.messages[uid][0]]
+        if criteria.startswith("UID "):
+            low = int(criteria[4:].split(":")[0])
+            return [uid for uid in uids if uid >= low] or uids[-1:]
+        if re.match(r'\d+:\*$', criteria):
+            return uids[int(criteria.split(":")[0]) - 1:]
+        return uids
+    
+    def bodystructure(self, uid):
+        """Return the BODYSTRUCTURE served for a UID"""
+        parts = ['("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" 10 1 NIL NIL NIL)']
+        for filename, data in self.attachments.get(uid, []):
+            parts.append(f'("APPLICATION" "OCTET-STREAM" ("NAME" "{filename}") NIL NIL "BASE64" {len(data)} NIL '
+                         f'("ATTACHMENT" ("FILENAME" "{filename}")) NIL)')
+        return "(" + "".join(parts) + ' "MIXED" ("BOUNDARY" "x") NIL NIL)'
+    
+    def raw_message(self, uid):
+        """Return the RFC822 bytes served for a UID"""
+        return (f"From: sender@example.com\r\nSubject: Message {uid}\r\n"
+                f"Message-ID: <{uid}@example.com>\r\n\r\nBody {uid}\r\n").encode()
+
+
+class FakeIdleConnection(FakeIMAPConnection):
+    """FakeIMAPConnection that delivers new messages during IDLE or on NOOP
+    
+    arrivals lists the UIDs of upcoming messages; each IDLE cycle or NOOP
+    adds the next one to the folder and reports it as EXISTS. Raw lines
+    sent by IDLE are recorded in sent.
+    """
+    
+    def __init__(self, messages, arrivals, **kwargs):
+        super().__init__(messages, **kwargs)
+        self.arrivals = list(arrivals)
+        self.sent = []
+        self._lines = []
+        self._tag = None
+    
+    def _arrive(self):
+        self.messages[self.arrivals.pop(0)] = ([], 1)
+        return str(len(self.messages)).encode()
+    
+    def noop(self):
+        self._responses["EXISTS"] = [self._arrive() if self.arrivals else None]
+        return "OK", [b"NOOP completed"]
+    
+    def send(self, data):
+        self.sent.append(data)
+        if data.endswith(b" IDLE\r\n"):
+            self._tag = data.split()[0]
+            self._lines = [b"+ idling\r\n"]
+            if self.arrivals:
+                self._lines.append(b"* " + self._arrive() + b" EXISTS\r\n")
+        elif data == b"DONE\r\n":
+            self._lines.append(self._tag + b" OK IDLE terminated\r\n")
+    
+    def readline(self):
+        return self._lines.pop(0)
+    
+    def pending_bytes(self):
+        return len(self._lines)
+
+
+class FakeIMAPPool:
+    """IMAPConnectionPool stand-in lending a new FakeIMAPConnection per borrow
+    
+    Every connection serves the same messages; all of them are kept in
+    connections so their commands can be inspected.
+    """
+    
+    def __init__(self, messages, uidvalidity=1, max_connections=4):
+        self.messages = messages
+        self.uidvalidity = uidvalidity
+        self.max_connections = max_connections
+        self.connections = []
+        self._lock = threading.Lock()
+    
+    @contextmanager
+    def connection(self):
+        connection = FakeIMAPConnection(self.messages, uidvalidity=self.uidvalidity)
+        with self._lock:
+            self.connections.append(connection)
+        yield connection
+
+
+class FakeStreamWriter:
+    """asyncio StreamWriter stand-in recording the bytes written"""
+    
+    def __init__(self):
+        self.data = b""
+    
+    def write(self, data):
+        self.data += data
+    
+    async def drain(self):
+        pass
+
+
+class FakeGmailError(Exception):
+    """HTTP error carrying a response status like googleapiclient's HttpError"""
+    
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.resp = type("Response", (), {"status": status})()
+
+
+class FakeGmailService:
+    """In-memory stand-in for the Gmail API users().messages() resource
+    
+    ids is the order messages are listed in, at most page_size per list
+    page; an id missing from store fails with 404. failures maps an id to
+    HTTP statuses returned on its first attempts. Every batch is recorded as
+    its list of request ids, every list call as (maxResults, pageToken, http).
+    """
+    
+    def __init__(self, ids, store, failures=None, page_size=500):
+        self.ids = list(ids)
+        self.store = store
+        self.failures = {msg_id: list(statuses) for msg_id, statuses in (failures or {}).items()}
+        self.page_size = page_size
+        self.batches = []
+        self.list_calls = []
+    
+    def users(self):
+        return self
+    
+    def messages(self):
+        return self
+    
+    def list(self, **kwargs):
+        start = int(kwargs.get("pageToken") or 0)
+        end = min(start + min(kwargs["maxResults"], self.page_size), len(self.ids))
+        
+        def list_page(http):
+            self.list_calls.append((kwargs["maxResults"], kwargs.get("pageToken"), http))
+            page = {"messages": [{"id": msg_id} for msg_id in self.ids[start:end]]}
+            if end < len(self.ids):
+                page["nextPageToken"] = str(end)
+            return page
+        
+        return FakeGmailRequest(list_page)
+    
+    def get(self, **kwargs):
+        return kwargs
+    
+    def new_batch_http_request(self, callback):
+        return FakeGmailBatch(self, callback)
+    
+    def respond(self, request):
+        """Return the message resource for a get request, or raise its error"""
+        msg_id = request["id"]
+        if self.failures.get(msg_id):
+            status = self.failures[msg_id].pop(0)
+            raise FakeGmailError(status, "userRateLimitExceeded" if status == 403 else f"HTTP {status}")
+        if msg_id not in self.store:
+            raise FakeGmailError(404, "Requested entity was not found.")
+        
+        message = self.store[msg_id]
+        if request.get("format") == "metadata":
+            payload = {"mimeType": message["payload"]["mimeType"], "headers": [
+                header for header in message["payload"]["headers"]
+                if header["name"] in request.get("metadataHeaders", [])
+            ]}
+            message = dict(message, payload=payload)
+        return message
+
+
+class FakeGmailRequest:
+    """Request object whose execute() returns a prepared response"""
+    
+    def __init__(self, response):
+        self.response = response
+    
+    def execute(self, http=None):
+        return self.response(http)
+
+
+class FakeGmailBatch:
+    """Batch request that answers each item through the callback"""
+    
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+    
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+    
+    def execute(self):
+        self.service.batches.append([request_id for request_id, _ in self.requests])
+        for request_id, request in self.requests:
+            try:
+                self.callback(request_id, self.service.respond(request), None)
+            except FakeGmailError as e:
+                self.callback(request_id, None, e)
+
+
+def gmail_message(msg_id, body="", snippet=""):
+    """Build a full-format Gmail API message resource with a text/plain body"""
+    import base64
+    return {
+        "id": msg_id,
+        "snippet": snippet,
+        "sizeEstimate": 100 + len(body),
+        "payload": {
+            "mimeType": "text/plain",
+            "headers": [{"name": "Subject", "value": f"Message {msg_id}"},
+                        {"name": "Date", "value": "Tue, 2 Jan 2024 10:00:00 +0000"}],
+            "body": {"data": base64.urlsafe_b64encode(body.encode()).decode()}
+        }
+    }
 
 
 def test_excel_exporter():
@@ -64,6 +363,22 @@ def test_excel_exporter():
         print(f"    Created: {csv_filename}")
         assert os.path.exists(csv_filename), "CSV file was not created"
         
+        print("  ✓ Creating streamed Excel and CSV exports...")
+        stream_filename = exporter.stream_to_excel(iter(sample_emails), "test_stream_export.xlsx")
+        assert os.path.exists(stream_filename), "Streamed Excel file was not created"
+        stream_csv = exporter.stream_to_csv(iter(sample_emails), "test_stream_export.csv")
+        assert os.path.exists(stream_csv), "Streamed CSV file was not created"
+        
+        print("  ✓ Testing EmailBatch and record rows match...")
+        from email_batch import EmailBatch
+        records = sample_emails + [{"id": "4", "attachment_details": [{"size": 10, "content_type": "text/csv"}],
+                                    "attachments": ["a.csv"], "attachment_paths": ["/tmp/a.csv"]}]
+        batch_df = exporter._emails_to_dataframe(EmailBatch(records))
+        rows_df = exporter._emails_to_dataframe(records)
+        assert batch_df.equals(rows_df), "EmailBatch export differs from the record export"
+        assert rows_df['Attachments'].tolist()[-1] == "/tmp/a.csv"
+        assert rows_df['Attachment Types'].tolist()[-1] == "text/csv"
+        
         print("  ✓ Creating in-memory buffer...")
         buffer = exporter.create_excel_buffer(sample_emails)
         assert buffer.getbuffer().nbytes > 0, "Buffer is empty"
@@ -97,6 +412,7 @@ def test_email_processor_structure():
         assert gmail_processor is not None
         assert hasattr(gmail_processor, 'connect_gmail_api')
         assert hasattr(gmail_processor, 'fetch_emails_api')
+        assert hasattr(gmail_processor, 'load_bodies')
         
         print("\n✅ Email Processor structure tests passed!")
         return True
@@ -137,10 +453,41 @@ def test_data_processing():
         assert 'Subject' in df.columns
         assert 'From' in df.columns
         assert 'Body' in df.columns
+        assert df.iloc[0]['Attachment Count'] == 0
         
         print("  ✓ Testing special character handling...")
         assert df.iloc[0]['Subject'] == "Test with special chars: <>&\"'"
         
+        print("  ✓ Testing columnar EmailBatch conversion...")
+        from email_batch import EmailBatch
+        batch = EmailBatch(test_emails + [{"subject": "Second", "attachments": ["a.pdf"], "has_attachments": True}])
+        assert len(batch) == 2 and batch[1]["subject"] == "Second" and "date" not in batch[1]
+        batch_df = exporter._emails_to_dataframe(batch)
+        assert list(batch_df.columns) == list(df.columns)
+        assert batch_df.iloc[1]['Attachments'] == "a.pdf" and batch_df.iloc[0]['Has Attachments'] == "No"
+        batch[1] = dict(batch[1], body_loaded=True)
+        assert batch.column("body_loaded") == [None, True]
+        
+        print("  ✓ Testing lean MIME parsing with declared charsets...")
+        raw = (
+            b"Subject: Invoice\r\nContent-Type: multipart/mixed; boundary=b\r\n\r\n"
+            b"--b\r\nContent-Type: text/plain; charset=iso-8859-1\r\n\r\nCaf\xe9\r\n"
+            b"--b\r\nContent-Type: application/pdf\r\nContent-Disposition: attachment; filename=a.pdf\r\n"
+            b"Content-Transfer-Encoding: base64\r\n\r\nJVBERi0xLjQK\r\n--b--\r\n"
+        )
+        parsed = EmailProcessor()._parse_email("1", raw)
+        assert parsed["body"] == "Café"
+        assert parsed["attachment_details"] == [{"filename": "a.pdf", "content_type": "application/pdf", "size": 9}]
+        
+        print("  ✓ Testing cached header decoding...")
+        from email_processor import header_cache_info
+        processor = EmailProcessor()
+        hits = header_cache_info().hits
+        encoded = "=?utf-8?b?w4lsw6lvbm9yZQ==?= <e@example.com>"
+        assert processor._decode_header(encoded) == "Éléonore <e@example.com>"
+        assert processor._decode_header(encoded) == "Éléonore <e@example.com>"
+        assert header_cache_info().hits == hits + 1
+        
         print("\n✅ Data processing tests passed!")
         return True
         
@@ -151,13 +498,990 @@ def test_data_processing():
         return False
 
 
+def test_html_to_text():
+    """Test HTML to plain text conversion"""
+    print("\nTesting HTML to Text Conversion...")
+    
+    try:
+        from html_text import html_to_text
+        
+        html = (
+            "<html><head><style>p { color: red; }</style></head><body>"
+            "<div style='display:none'>Preheader <div>text</div></div>"
+            "<h1>News &amp; updates</h1><p>First  line<br>second line</p>"
+            "<p>Caf&eacute; &#8364;5</p><script>track();</script></body></html>"
+        )
+        
+        print("  ✓ Testing hidden content, entities and paragraph breaks...")
+        text = html_to_text(html)
+        assert text == "News & updates\n\nFirst line\nsecond line\n\nCafé €5"
+        
+        print("  ✓ Testing hidden elements with optional end tags...")
+        assert html_to_text("<p hidden>x<p>Main text</p><p>more</p>") == "Main text\n\nmore"
+        assert html_to_text(
+            "<ul><li style='display:none'>pre<li>Visible item<li>Two</ul><p>Footer</p>"
+        ) == "Visible item\nTwo\n\nFooter"
+        assert html_to_text("<div><span hidden>x<b>y</b></div>after") == "after"
+        assert html_to_text(
+            "<table><tr><td hidden>x<tr><td>visible row</td></tr></table><p>after</p>"
+        ) == "visible row\n\nafter"
+        assert html_to_text("<table><tr><td hidden><b>x<td>cell</table>") == "cell"
+        assert html_to_text("<ul><li hidden><ol><li>x<li>y</ol><li>shown</ul>") == "shown"
+        
+        print("  ✓ Testing list and option item separation...")
+        assert html_to_text("<select><option>One<option>Two</select>") == "One\nTwo"
+        assert html_to_text("<ul><li>One<li>Two</ul>") == "One\nTwo"
+        
+        print("  ✓ Testing character budget...")
+        assert html_to_text("<p>" + "word " * 100000 + "</p>", max_chars=50) == ("word " * 10).strip()
+        
+        print("\n✅ HTML to text tests passed!")
+        return True
+        
+    except Exception as e:
+        print(f"\n❌ HTML to text test failed: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_imap_response_parsing():
+    """Test parsing of batched IMAP FETCH responses"""
+    print("\nTesting IMAP Response Parsing...")
+    
+    try:
+        from imap_response import (
+            parse_bodystructure, parse_envelope, parse_esearch, parse_fetch_response,
+            tail_of_sequence_set, uid_set
+        )
+        
+        raw = b"Subject: Batched\r\n\r\nBody"
+        data = [
+            (b'1 (UID 10 RFC822 {%d}' % len(raw), raw),
+            b')',
+            b'2 (FLAGS (\\Seen))',
+            (b'3 (UID 12 RFC822 {%d}' % len(raw), raw),
+            b')'
+        ]
+        
+        print("  ✓ Testing multi-message FETCH parsing...")
+        messages = parse_fetch_response(data)
+        uids = [items["UID"] for _, items in messages if "UID" in items]
+        assert uids == ["10", "12"]
+        assert messages[0][1]["RFC822"] == raw
+        
+        print("  ✓ Testing ENVELOPE and BODYSTRUCTURE parsing...")
+        header_data = [
+            b'1 (UID 5 ENVELOPE ("Mon, 1 Jan 2024 10:00:00 +0000" "Report" '
+            b'(("Alice" NIL "alice" "example.com")) NIL NIL NIL NIL NIL NIL "<m1@example.com>") '
+            b'BODYSTRUCTURE (("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" 10 1 NIL NIL NIL)'
+            b'("APPLICATION" "PDF" ("NAME" "a.pdf") NIL NIL "BASE64" 3000 NIL '
+            b'("ATTACHMENT" ("FILENAME" "a.pdf")) NIL) "MIXED" ("BOUNDARY" "x") NIL NIL))'
+        ]
+        items = parse_fetch_response(header_data)[0][1]
+        envelope = parse_envelope(items["ENVELOPE"])
+        assert envelope["from"] == "Alice <alice@example.com>"
+        assert envelope["message_id"] == "<m1@example.com>"
+        parts = parse_bodystructure(items["BODYSTRUCTURE"])
+        assert [part["section"] for part in parts] == ["1", "2"]
+        assert parts[1]["filename"] == "a.pdf" and parts[1]["disposition"] == "attachment"
+        details = EmailProcessor()._headers_record(items, "INBOX")["attachment_details"]
+        assert details == [{"filename": "a.pdf", "content_type": "application/pdf", "size": 2192,
+                            "section": "2", "encoding": "base64"}]
+        
+        print("  ✓ Testing UID set compression...")
+        assert uid_set([b"1", b"2", b"3", b"7", b"9", b"10"]) == "1:3,7,9:10"
+        
+        print("  ✓ Testing ESEARCH result parsing...")
+        esearch = parse_esearch(b'(TAG "A1") UID COUNT 17 ALL 4:18,21,28')
+        assert esearch["COUNT"] == "17"
+        assert tail_of_sequence_set(esearch["ALL"], 4) == [b"17", b"18", b"21", b"28"]
+        
+        print("\n✅ IMAP response parsing tests passed!")
+        return True
+        
+    except Exception as e:
+        print(f"\n❌ IMAP response parsing test failed: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_imap_compression():
+    """Test COMPRESS=DEFLATE framing and byte counters without a server"""
+    print("\nTesting IMAP Compression...")
+    
+    try:
+        import io
+        import zlib
+        from imap_compress import CompressedIMAP4_SSL
+        
+        class ChunkedSocketFile(io.RawIOBase):
+            """Raw stream returning at most 5 bytes per read, like a slow socket"""
+            
+            def __init__(self, data):
+                self.data = data
+            
+            def readable(self):
+                return True
+            
+            def readinto(self, buffer):
+                size = min(len(buffer), 5, len(self.data))
+                buffer[:size], self.data = self.data[:size], self.data[size:]
+                return size
+        
+        literal = b"x" * 1000
+        responses = [b"* 1 FETCH (UID 7 BODY[] {1000}\r\n" + literal + b")\r\n", b"a1 OK FETCH done\r\n"]
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        wire = b"".join(compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH) for data in responses)
+        
+        connection = CompressedIMAP4_SSL.__new__(CompressedIMAP4_SSL)
+        connection.compressed = True
+        connection.bytes_received = connection.wire_bytes_received = 0
+        connection._decompressor = zlib.decompressobj(-15)
+        connection._buffer = bytearray()
+        socket_file = ChunkedSocketFile(wire)
+        connection.file = io.BufferedReader(socket_file)
+        
+        print("  ✓ Testing line and literal reads across deflate chunks...")
+        assert connection.readline() == b"* 1 FETCH (UID 7 BODY[] {1000}\r\n"
+        assert connection.read(1000) == literal
+        assert connection.readline() == b")\r\n"
+        assert connection.readline() == b"a1 OK FETCH done\r\n"
+        assert connection.pending_bytes() == 0
+        
+        print("  ✓ Testing compression counters...")
+        assert connection.bytes_received == sum(len(data) for data in responses)
+        wire_read = len(wire) - len(socket_file.data)
+        assert connection.wire_bytes_received == wire_read
+        assert connection.compression_ratio == connection.bytes_received / wire_read > 10
+        
+        print("\n✅ IMAP compression tests passed!")
+        return True
+        
+    except Exception as e:
+        print(f"\n❌ IMAP compression test failed: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_search_and_count():
+    """Test UID searches and counts with and without ESEARCH"""
+    print("\nTesting Search and Count...")
+    
+    try:
+        connection = FakeIMAPConnection({2: ([], 1), 4: ([], 1), 6: (["\\Seen"], 1), 9: ([], 1), 11: ([], 1)})
+        processor = EmailProcessor()
+        processor.connection = connection
+        
+        print("  ✓ Testing plain UID SEARCH...")
+        assert processor._search_uids("INBOX", "ALL", 2) == [b"9", b"11"]
+        assert connection.commands[-1] == ("SEARCH", "4:*")
+        assert processor._search_uids("INBOX", "UNSEEN", None) == [b"2", b"4", b"9", b"11"]
+        assert processor._search_uids("INBOX", "UNSEEN", 3) == [b"4", b"9", b"11"]
+        assert processor.count_emails("INBOX") == 5
+        assert connection.commands[-1] == ("SEARCH", "UNSEEN")
+        assert processor.count_emails("INBOX", "UNSEEN") == 4
+        assert connection.commands[-1] == ("SEARCH", "UNSEEN")
+        
+        print("  ✓ Testing ESEARCH...")
+        connection.capabilities = ("IMAP4REV1", "ESEARCH")
+        connection.commands.clear()
+        assert processor._search_uids("INBOX", "ALL", 2) == [b"9", b"11"]
+        assert processor._search_uids("INBOX", "UNSEEN", 3) == [b"4", b"9", b"11"]
+        assert processor._search_uids("INBOX", "UNSEEN", None) == [b"2", b"4", b"9", b"11"]
+        assert processor.count_emails("INBOX", "UNSEEN") == 4
+        assert connection.commands == [
+            ("SEARCH", "RETURN (ALL)", "4:*"),
+            ("SEARCH", "RETURN (ALL)", "UNSEEN"),
+            ("SEARCH", "RETURN (ALL)", "UNSEEN"),
+            ("SEARCH", "RETURN (COUNT)", "UNSEEN")
+        ]
+        
+        print("\n✅ Search and count tests passed!")
+        return True
+        
+    except Exception as e:
+        print(f"\n❌ Search and count test failed: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_connection_pool():
+    """Test blocking, reuse, discard and close of the IMAP connection pool"""
+    print("\nTesting Connection Pool...")
+    
+    try:
+        from imap_pool import IMAPConnectionPool
+        
+        class DummyConnection:
+            def __init__(self, number):
+                self.number = number
+                self.logged_out = False
+            
+            def logout(self):
+                self.logged_out = True
+        
+        opened = []
+        
+        def factory():
+            opened.append(DummyConnection(len(opened) + 1))
+            return opened[-1]
+        
+        pool = IMAPConnectionPool(factory, max_connections=2)
+        
+        print("  ✓ Testing blocking at max_connections...")
+        first, second = pool.acquire(), pool.acquire()
+        borrowed = []
+        waiter = threading.Thread(target=lambda: borrowed.append(pool.acquire()))
+        waiter.start()
+        waiter.join(0.2)
+        assert waiter.is_alive() and not borrowed
+        
+        print("  ✓ Testing reuse of released connections...")
+        pool.release(first)
+        waiter.join(2)
+        assert borrowed == [first] and len(opened) == 2
+        pool.release(first)
+        pool.release(second)
+        
+        print("  ✓ Testing discard when the with-block raises...")
+        try:
+            with pool.connection() as connection:
+                failed = connection
+                raise RuntimeError("connection dropped")
+        except RuntimeError:
+            pass
+        assert failed.logged_out
+        with pool.connection() as a, pool.connection() as b:
+            assert failed not in (a, b)
+        assert len(opened) == 3
+        
+        print("  ✓ Testing close...")
+        pool.close()
+        assert all(connection.logged_out for connection in opened)
+        try:
+            pool.acquire()
+            assert False, "acquire() after close() should fail"
+        except AssertionError:
+            raise
+        except Exception:
+            pass
+        
+        print("\n✅ Connection pool tests passed!")
+        return True
+        
+    except Exception as e:
+        print(f"\n❌ Connection pool test failed: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_async_imap():
+    """Test the asyncio IMAP client against an in-memory stream"""
+    print("\nTesting Async IMAP...")
+    
+    try:
+        import asyncio
+        from async_email_processor import AsyncEmailProcessor, AsyncIMAPConnection
+        
+        def open_connection(server_data):
+            connection = AsyncIMAPConnection()
+            connection.reader = asyncio.StreamReader()
+            connection.reader.feed_data(server_data)
+            connection.reader.feed_eof()
+            connection.writer = FakeStreamWriter()
+            return connection
+        
+        async def run_commands():
+            connection = open_connection(
+                b"* 3 EXISTS\r\n* OK [UIDVALIDITY 7] UIDs valid\r\nA00001 OK SELECT completed\r\n"
+                b"* 1 FETCH (UID 5 BODY[HEADER] {13}\r\nSubject: Hi\r\n BODY[TEXT] {5}\r\nHello)\r\n"
+                b"A00002 OK FETCH completed\r\n"
+                b"A00003 NO [NONEXISTENT] Unknown folder\r\n"
+            )
+            selected = await connection.command("SELECT", '"INBOX"')
+            fetched = await connection.command("UID", "FETCH", "5", "(BODY.PEEK[HEADER] BODY.PEEK[TEXT])")
+            try:
+                await connection.command("SELECT", '"Missing"')
+                failed = False
+            except Exception:
+                failed = True
+            return connection, selected, fetched, failed
+        
+        print("  ✓ Testing tagged completion and untagged responses...")
+        connection, selected, fetched, failed = asyncio.run(run_commands())
+        assert selected == ("OK", {"EXISTS": [b"3"], "UIDVALIDITY": [b"7"], "OK": [b"[UIDVALIDITY 7] UIDs valid"]})
+        assert connection.writer.data.split(b"\r\n")[:2] == [
+            b'A00001 SELECT "INBOX"', b"A00002 UID FETCH 5 (BODY.PEEK[HEADER] BODY.PEEK[TEXT])"
+        ]
+        assert failed
+        
+        print("  ✓ Testing FETCH responses with several literals...")
+        assert fetched[1]["FETCH"] == [
+            (b"1 (UID 5 BODY[HEADER] {13}", b"Subject: Hi\r\n"),
+            (b" BODY[TEXT] {5}", b"Hello"),
+            b")"
+        ]
+        
+        print("  ✓ Testing parsing off the event loop...")
+        raw = b"Subject: Async\r\nMessage-ID: <a@example.com>\r\n\r\nBody\r\n"
+        processor = AsyncEmailProcessor()
+        parse_threads = []
+        parse_email = processor._parser._parse_email
+        
+        def record_thread(*args):
+            parse_threads.append(threading.current_thread())
+            return parse_email(*args)
+        
+        processor._parser._parse_email = record_thread
+        
+        async def run_fetch():
+            processor.connection = open_connection(
+                b"A00001 OK SELECT completed\r\n* SEARCH 4 9\r\nA00002 OK SEARCH completed\r\n"
+                + b"".join(
+                    b"* %d FETCH (UID %d FLAGS (\\Seen) BODY[] {%d}\r\n%s)\r\n" % (seq, uid, len(raw), raw)
+                    for seq, uid in ((1, 4), (2, 9))
+                )
+                + b"A00003 OK FETCH completed\r\n"
+            )
+            return await processor.fetch_emails("INBOX")
+        
+        emails = asyncio.run(run_fetch())
+        assert [(e["id"], e["subject"], e["flags"]) for e in emails] == [
+            ("4", "Async", ["\\Seen"]), ("9", "Async", ["\\Seen"])
+        ]
+        assert parse_threads and threading.main_thread() not in parse_threads
+        
+        print("\n✅ Async IMAP tests passed!")
+        return True
+        
+    except Exception as e:
+        print(f"\n❌ Async IMAP test failed: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_partial_body_decoding():
+    """Test decoding of text parts truncated by a body_limit fetch"""
+    print("\nTesting Partial Body Decoding...")
+    
+    try:
+        import base64
+        
+        processor = EmailProcessor()
+        part = {"type": "text/plain", "encoding": "base64", "params": {"charset": "utf-8"}}
+        
+        print("  ✓ Testing base64 octet budget with CRLF line breaks...")
+        encoded = base64.encodebytes(b"a" * 5000).replace(b"\n", b"\r\n")
+        octets = processor._partial_octets(part, 2048)
+        assert processor._decode_partial_body(encoded[:octets], part, 2048) == "a" * 2048
+        
+        print("  ✓ Testing base64 cut mid-quantum...")
+        assert processor._decode_partial_body(base64.b64encode(b"Hello world!")[:10], part, 100) == "Hello"
+        
+        print("  ✓ Testing quoted-printable with a partial escape...")
+        part = {"type": "text/plain", "encoding": "quoted-printable", "params": {"charset": "utf-8"}}
+        assert processor._decode_partial_body(b"Caf=C3=A9 au lait =C", part, 100) == "Café au lait"
+        assert processor._decode_partial_body(b"Caf=C3=A9 =", part, 100) == "Café"
+        
+        print("  ✓ Testing unknown charsets...")
+        part = {"type": "text/plain", "encoding": "8bit", "params": {"charset": "x-unknown"}}
+        assert processor._decode_partial_body("Grüße".encode("utf-8"), part, 100) == "Grüße"
+        
+        print("\n✅ Partial body decoding tests passed!")
+        return True
+        
+    except Exception as e:
+        print(f"\n❌ Partial body decoding test failed: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_partitioned_fetch():
+    """Test fetching contiguous UID ranges over pooled connections"""
+    print("\nTesting Partitioned Fetch...")
+    
+    try:
+        messages = {uid: ([], 1) for uid in range(1, 11)}
+        processor = EmailProcessor()
+        processor.connection = FakeIMAPConnection(messages)
+        processor.email_address = "user@example.com"
+        processor._credentials = ("user@example.com", "secret", "imap.example.com")
+        processor.pool = FakeIMAPPool(messages, max_connections=3)
+        
+        print("  ✓ Testing contiguous ranges per connection...")
+        emails = processor.fetch_emails("INBOX", batch_size=2, parallelism=4)
+        ranges = sorted([c[1] for c in connection.commands if c[0] == "FETCH"]
+                        for connection in processor.pool.connections)
+        assert ranges == [["1:2", "3:4"], ["5:6", "7:8"], ["9:10"]]
+        
+        print("  ✓ Testing merged records keep UID order...")
+        assert [e["id"] for e in emails] == [str(uid) for uid in range(1, 11)]
+        
+        print("  ✓ Testing UIDVALIDITY change during the fetch...")
+        processor.pool = FakeIMAPPool(messages, uidvalidity=2, max_connections=3)
+        try:
+            processor.fetch_emails("INBOX", batch_size=2, parallelism=4)
+            assert False, "UIDVALIDITY change was not detected"
+        except Exception as e:
+            assert "UIDVALIDITY of INBOX changed during fetch" in str(e)
+        
+        print("\n✅ Partitioned fetch tests passed!")
+        return True
+        
+    except Exception as e:
+        print(f"\n❌ Partitioned fetch test failed: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_parallel_parsing():
+    """Test MIME parsing in a process pool while the next batch downloads"""
+    print("\nTesting Parallel Parsing...")
+    
+    try:
+        import tempfile
+        from email_cache import EmailCache
+        
+        with tempfile.TemporaryDirectory() as root:
+            cache = EmailCache(os.path.join(root, "cache.sqlite3"))
+            connection = FakeIMAPConnection({uid: ([], 1) for uid in range(1, 8)})
+            processor = EmailProcessor(cache=cache)
+            processor.parse_workers = 2
+            processor.connection = connection
+            processor.email_address = "user@example.com"
+            
+            print("  ✓ Testing records come back in UID order...")
+            emails = processor.fetch_emails("INBOX", batch_size=3)
+            assert [(e["id"], e["subject"]) for e in emails] == [(str(uid), f"Message {uid}") for uid in range(1, 8)]
+            assert [c[1] for c in connection.commands if c[0] == "FETCH"] == ["1:3", "4:6", "7"]
+            
+            print("  ✓ Testing parsed records are cached...")
+            assert cache.get_uids("user@example.com", "INBOX") == list(range(1, 8))
+            connection.commands.clear()
+            assert [e["id"] for e in processor.fetch_emails("INBOX", batch_size=3)] == [str(uid) for uid in range(1, 8)]
+            assert [c for c in connection.commands if c[0] == "FETCH"] == []
+            
+            print("  ✓ Testing the pool is shut down on disconnect...")
+            executor = processor._parse_executor
+            assert executor is not None
+            processor.disconnect()
+            assert processor._parse_executor is None
+            try:
+                executor.submit(int)
+                assert False, "executor still accepts work"
+            except RuntimeError:
+                pass
+            cache.close()
+        
+        print("\n✅ Parallel parsing tests passed!")
+        return True
+        
+    except Exception as e:
+        print(f"\n❌ Parallel parsing test failed: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_raw_message_store():
+    """Test storing and re-reading raw messages"""
+    print("\nTesting Raw Message Store...")
+    
+    try:
+        import tempfile
+        from raw_store import RawMessageStore
+        
+        with tempfile.TemporaryDirectory() as root:
+            store = RawMessageStore(root)
+            raw = b"Message-ID: <m1@example.com>\r\nSubject: Stored\r\n\r\nBody"
+            
+            print("  ✓ Testing content-addressed writes...")
+            digest = store.put(raw, "user@example.com", "INBOX", 7, b"42")
+            assert store.put(raw) == digest
+            assert store.get(digest) == raw
+            
+            print("  ✓ Testing lookups by UID and Message-ID...")
+            assert store.get_uids("user@example.com", "INBOX", 7, [b"42", b"43"]) == {"42": raw}
+            assert store.get_uids("user@example.com", "INBOX", 8, [b"42"]) == {}
+            assert store.get_by_message_id("<m1@example.com>") == raw
+            
+            print("  ✓ Testing offline re-parsing...")
+            processor = EmailProcessor(raw_store=store)
+            emails = list(processor.iter_stored_emails(account="user@example.com"))
+            assert [(e["id"], e["folder"], e["subject"]) for e in emails] == [("42", "INBOX", "Stored")]
+            store.close()
+        
+        print("\n✅ Raw message store tests passed!")
+        return True
+        
+    except Exception as e:
+        print(f"\n❌ Raw message store test failed: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_email_cache():
+    """Test the SQLite email cache and incremental UID search"""
+    print("\nTesting Email Cache...")
+    
+    try:
+        import tempfile
+        from email_cache import EmailCache
+        
+        with tempfile.TemporaryDirectory() as root:
+            cache = EmailCache(os.path.join(root, "cache.sqlite3"))
+            
+            print("  ✓ Testing store/get round trip...")
+            assert not cache.validate_folder("user@example.com", "INBOX", 5)
+            record = {"id": "3", "subject": "Cached", "date": datetime(2024, 1, 2, 10, 30), "flags": ["\\Seen"]}
+            cache.store_emails("user@example.com", "INBOX", [record, {"id": "1", "subject": "Old"}])
+            assert cache.get_emails("user@example.com", "INBOX", [b"3", b"7"]) == {"3": record}
+            assert cache.get_uids("user@example.com", "INBOX") == [1, 3]
+            assert cache.get_folder_state("user@example.com", "INBOX")["synced_uid"] == 0
+            
+            print("  ✓ Testing full search when only a subset was fetched...")
+            connection = FakeIMAPConnection({1: ([], 1), 2: (["\\Seen"], 1), 3: ([], 1)}, uidvalidity=5)
+            processor = EmailProcessor(cache=cache)
+            processor.connection = connection
+            processor.email_address = "user@example.com"
+            cache.store_emails("user@example.com", "INBOX", [{"id": "1", "subject": "Old"}])
+            assert [e["id"] for e in processor.fetch_emails("INBOX", search_criteria="UNSEEN")] == ["1", "3"]
+            del connection.messages[3]
+            connection.commands.clear()
+            assert [e["id"] for e in processor.fetch_emails("INBOX")] == ["1", "2"]
+            assert connection.commands[0][:2] == ("SEARCH", "ALL")
+            assert cache.get_folder_state("user@example.com", "INBOX")["synced_uid"] == 2
+            
+            print("  ✓ Testing incremental search above the synced UID...")
+            connection.messages[4] = ([], 1)
+            connection.commands.clear()
+            assert [e["id"] for e in processor.fetch_emails("INBOX")] == ["1", "2", "4"]
+            assert [c[:2] for c in connection.commands] == [("SEARCH", "UID 3:*"), ("FETCH", "4")]
+            
+            print("  ✓ Testing full search after an expunge and a new arrival...")
+            del connection.messages[2]
+            connection.messages[5] = ([], 1)
+            connection.commands.clear()
+            assert [e["id"] for e in processor.fetch_emails("INBOX")] == ["1", "4", "5"]
+            assert [c[:2] for c in connection.commands] == [("SEARCH", "UID 5:*"), ("SEARCH", "ALL"), ("FETCH", "5")]
+            assert cache.get_uids("user@example.com", "INBOX") == [1, 4, 5]
+            assert cache.get_folder_state("user@example.com", "INBOX")["synced_uid"] == 5
+            connection.commands.clear()
+            assert [e["id"] for e in processor.fetch_emails("INBOX")] == ["1", "4", "5"]
+            assert [c[:2] for c in connection.commands] == [("SEARCH", "UID 6:*")]
+            
+            print("  ✓ Testing UIDVALIDITY change...")
+            assert cache.validate_folder("user@example.com", "INBOX", 5)
+            assert not cache.validate_folder("user@example.com", "INBOX", 6)
+            assert cache.get_emails("user@example.com", "INBOX", [1, 3]) == {}
+            assert cache.get_folder_state("user@example.com", "INBOX")["synced_uid"] == 0
+            cache.close()
+        
+        print("\n✅ Email cache tests passed!")
+        return True
+        
+    except Exception as e:
+        print(f"\n❌ Email cache test failed: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_cache_resync():
+    """Test CONDSTORE/QRESYNC resynchronization of cached flags and expunges"""
+    print("\nTesting Cache Resync...")
+    
+    try:
+        import tempfile
+        from email_cache import EmailCache
+        
+        account = "user@example.com"
+        with tempfile.TemporaryDirectory() as root:
+            cache = EmailCache(os.path.join(root, "cache.sqlite3"))
+            cache.validate_folder(account, "INBOX", 1)
+            cache.store_emails(account, "INBOX", [{"id": str(uid), "flags": []} for uid in (1, 2, 3)])
+            
+            connection = FakeIMAPConnection({1: (["\\Seen"], 5), 3: ([], 2)},
+                                            capabilities=("IMAP4REV1", "CONDSTORE"), expunged={2: 4})
+            processor = EmailProcessor(cache=cache)
+            processor.connection = connection
+            processor.email_address = account
+            
+            print("  ✓ Testing first resync of records cached without a MODSEQ...")
+            assert processor.resync_folder("INBOX") == {"updated": 2, "removed": 1}
+            assert connection.commands[-1] == ("FETCH", "1:3", "(UID FLAGS)")
+            assert cache.get_emails(account, "INBOX", [1])["1"]["flags"] == ["\\Seen"]
+            assert cache.get_uids(account, "INBOX") == [1, 3]
+            assert cache.get_folder_state(account, "INBOX")["highest_modseq"] == 5
+            
+            print("  ✓ Testing CHANGEDSINCE with expunge detection on a CONDSTORE-only server...")
+            del connection.messages[1]
+            connection.expunged[1] = 6
+            connection.messages[3] = (["\\Flagged"], 7)
+            assert processor.resync_folder("INBOX") == {"updated": 1, "removed": 1}
+            assert ("FETCH", "1:*", "(UID FLAGS)", "(CHANGEDSINCE 5)") in connection.commands
+            assert connection.commands[-1] == ("SEARCH", "ALL")
+            assert cache.get_emails(account, "INBOX", [3])["3"]["flags"] == ["\\Flagged"]
+            assert cache.get_uids(account, "INBOX") == [3]
+            
+            print("  ✓ Testing QRESYNC VANISHED (EARLIER) responses...")
+            cache.store_emails(account, "INBOX", [{"id": "5", "flags": []}])
+            connection.capabilities = ("IMAP4REV1", "CONDSTORE", "QRESYNC", "ENABLE")
+            del connection.messages[3]
+            connection.expunged[3] = 9
+            connection.messages[5] = (["\\Answered"], 10)
+            connection.commands.clear()
+            assert processor.resync_folder("INBOX") == {"updated": 1, "removed": 1}
+            assert connection.commands == [("FETCH", "1:*", "(UID FLAGS)", "(CHANGEDSINCE 7 VANISHED)")]
+            assert cache.get_uids(account, "INBOX") == [5]
+            assert cache.get_folder_state(account, "INBOX")["highest_modseq"] == 10
+            
+            print("  ✓ Testing flag updates and range deletes on the cache...")
+            assert cache.update_flags(account, "INBOX", {"5": ["\\Seen"], "99": []}) == 1
+            assert cache.delete_uid_ranges(account, "INBOX", [(1, 4), (5, 5)]) == 1
+            cache.close()
+        
+        print("\n✅ Cache resync tests passed!")
+        return True
+        
+    except Exception as e:
+        print(f"\n❌ Cache resync test failed: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_watch_new_emails():
+    """Test the IDLE/NOOP watch loop and caching of the emails it receives"""
+    print("\nTesting New Email Watching...")
+    
+    try:
+        import tempfile
+        from email_cache import EmailCache
+        
+        with tempfile.TemporaryDirectory() as root:
+            cache = EmailCache(os.path.join(root, "cache.sqlite3"))
+            connection = FakeIdleConnection({1: ([], 1)}, arrivals=[2, 3])
+            processor = EmailProcessor(cache=cache)
+            processor.connection = connection
+            processor.email_address = "user@example.com"
+            
+            print("  ✓ Testing NOOP polling...")
+            stop_event = threading.Event()
+            received = []
+            for email_data in processor.iter_new_emails("INBOX", stop_event=stop_event, poll_interval=0):
+                received.append(email_data["id"])
+                if len(received) == 2:
+                    stop_event.set()
+            assert received == ["2", "3"]
+            assert [c[:2] for c in connection.commands if c[0] == "FETCH"] == [("FETCH", "2"), ("FETCH", "3")]
+            
+            print("  ✓ Testing watched emails stay cached...")
+            connection.commands.clear()
+            assert [e["id"] for e in processor.fetch_emails("INBOX")] == ["1", "2", "3"]
+            assert [c[:2] for c in connection.commands if c[0] == "FETCH"] == [("FETCH", "1")]
+            
+            print("  ✓ Testing IDLE...")
+            connection.capabilities = ("IMAP4REV1", "IDLE")
+            connection.arrivals = [4]
+            stop_event = threading.Event()
+            assert processor.watch("INBOX", on_email=lambda e: stop_event.set(), stop_event=stop_event) == 1
+            assert connection.sent == [b"IDLE1 IDLE\r\n", b"DONE\r\n"]
+            assert cache.get_uids("user@example.com", "INBOX") == [1, 2, 3, 4]
+            cache.close()
+        
+        print("\n✅ New email watching tests passed!")
+        return True
+        
+    except Exception as e:
+        print(f"\n❌ New email watching test failed: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_gmail_batch_fetch():
+    """Test batched Gmail API message retrieval with per-message errors"""
+    print("\nTesting Gmail Batch Fetch...")
+    
+    try:
+        ids = ["a", "b", "c", "d", "e"]
+        store = {msg_id: gmail_message(msg_id, f"Body {msg_id}") for msg_id in ids if msg_id != "d"}
+        service = FakeGmailService(ids, store, failures={"b": [429], "e": [403]})
+        processor = GmailAPIProcessor()
+        processor.service = service
+        processor.batch_size = 2
+        processor.retry_delay = 0
+        
+        print("  ✓ Testing batching, retries and list order...")
+        emails = processor.fetch_emails_api(max_results=5)
+        assert [e["id"] for e in emails] == ["a", "b", "c", "e"]
+        assert emails[1]["body"] == "Body b"
+        assert service.batches == [["a", "b"], ["b"], ["c", "d"], ["e"], ["e"]]
+        
+        print("  ✓ Testing retry limit for repeated rate limiting...")
+        service = FakeGmailService(["x"], {"x": gmail_message("x")}, failures={"x": [503] * 5})
+        processor.service = service
+        processor.max_retries = 2
+        assert len(processor.fetch_emails_api(max_results=1)) == 0
+        assert service.batches == [["x"], ["x"], ["x"]]
+        
+        print("\n✅ Gmail batch fetch tests passed!")
+        return True
+        
+    except Exception as e:
+        print(f"\n❌ Gmail batch fetch test failed: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_gmail_pagination():
+    """Test following nextPageToken when listing Gmail messages"""
+    print("\nTesting Gmail Pagination...")
+    
+    try:
+        ids = [str(i) for i in range(7)]
+        store = {msg_id: gmail_message(msg_id) for msg_id in ids}
+        processor = GmailAPIProcessor()
+        processor.retry_delay = 0
+        
+        print("  ✓ Testing every page with max_results=None...")
+        processor.service = FakeGmailService(ids, store, page_size=3)
+        assert [e["id"] for e in processor.fetch_emails_api(max_results=None)] == ids
+        assert processor.service.list_calls == [(500, None, None), (500, "3", None), (500, "6", None)]
+        
+        print("  ✓ Testing the max_results cut-off inside a page...")
+        processor.service = FakeGmailService(ids, store, page_size=3)
+        assert [e["id"] for e in processor.fetch_emails_api(max_results=4)] == ids[:4]
+        assert processor.service.list_calls == [(4, None, None), (1, "3", None)]
+        
+        print("  ✓ Testing background page listing over a separate connection...")
+        processor.service = FakeGmailService(ids, store, page_size=3)
+        processor._new_http = lambda: "page-http"
+        emails = processor.iter_emails_api(max_results=None)
+        assert next(emails)["id"] == "0"
+        emails.close()
+        assert [call[2] for call in processor.service.list_calls] == ["page-http", "page-http"]
+        
+        print("\n✅ Gmail pagination tests passed!")
+        return True
+        
+    except Exception as e:
+        print(f"\n❌ Gmail pagination test failed: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_gmail_metadata_mode():
+    """Test Gmail metadata-only listing with lazily loaded bodies"""
+    print("\nTesting Gmail Metadata Mode...")
+    
+    try:
+        from email_batch import EmailBatch
+        
+        ids = ["a", "b", "c"]
+        store = {msg_id: gmail_message(msg_id, f"Full body {msg_id}", snippet="Tom &amp; Jerry&#39;s")
+                 for msg_id in ids}
+        processor = GmailAPIProcessor()
+        processor.service = FakeGmailService(ids, store)
+        
+        print("  ✓ Testing metadata records...")
+        email_data = processor._email_from_message_api("a", store["a"], headers_only=True)
+        assert email_data["body_loaded"] is False
+        assert email_data["body"] == ""
+        assert email_data["snippet"] == "Tom & Jerry's"
+        
+        emails = processor.fetch_emails_api(max_results=3, headers_only=True)
+        assert isinstance(emails, EmailBatch)
+        assert emails.column("subject") == ["Message a", "Message b", "Message c"]
+        assert emails.column("body_loaded") == [False, False, False]
+        
+        print("  ✓ Testing lazy body loading into an EmailBatch...")
+        emails[1] = processor.load_body(emails[1])
+        assert emails[1]["body"] == "Full body b"
+        assert processor.load_bodies(emails) is emails
+        assert emails.column("body") == ["Full body a", "Full body b", "Full body c"]
+        assert emails.column("body_loaded") == [True, True, True]
+        assert processor.service.batches == [ids, ["b"], ["a", "c"]]
+        
+        print("\n✅ Gmail metadata mode tests passed!")
+        return True
+        
+    except Exception as e:
+        print(f"\n❌ Gmail metadata mode test failed: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_attachment_store():
+    """Test streamed decoding and deduplication of saved attachments"""
+    print("\nTesting Attachment Store...")
+    
+    try:
+        import base64
+        import tempfile
+        from attachment_store import AttachmentStore
+        
+        with tempfile.TemporaryDirectory() as root:
+            store = AttachmentStore(root)
+            content = bytes(range(256)) * 400
+            encoded = base64.encodebytes(content)
+            
+            print("  ✓ Testing chunked base64 decoding...")
+            chunks = [encoded[i:i + 999] for i in range(0, len(encoded), 999)]
+            path = store.save(chunks, "invoice.pdf", "base64", "application/pdf")
+            with open(path, "rb") as f:
+                assert f.read() == content
+            assert os.path.basename(path) == "invoice.pdf"
+            
+            print("  ✓ Testing deduplication across messages...")
+            assert store.save([encoded], "invoice (1).pdf", "base64") == path
+            assert store.save([base64.b64encode(content)], "copy.pdf", "base64") == path
+            assert store.stats() == {"stored": 1, "duplicates": 2}
+            
+            print("  ✓ Testing temporary files are removed when a download fails...")
+            def failing_chunks():
+                yield encoded[:100]
+                raise OSError("connection reset")
+            try:
+                store.save(failing_chunks(), "broken.pdf", "base64")
+                assert False, "save did not raise"
+            except OSError:
+                pass
+            assert os.listdir(os.path.join(root, "tmp")) == []
+            
+            print("  ✓ Testing ranged IMAP part downloads...")
+            report = b"quarterly report " * 4000
+            report_encoded = base64.encodebytes(report)
+            connection = FakeIMAPConnection({5: ([], 1), 6: ([], 1)}, attachments={5: [("report.pdf", report_encoded)]})
+            processor = EmailProcessor()
+            processor.connection = connection
+            emails = [{"id": "5", "folder": "INBOX", "has_attachments": True},
+                      {"id": "6", "folder": "INBOX", "has_attachments": False}]
+            assert processor.save_attachments(emails, store, chunk_size=20000) == 1
+            with open(emails[0]["attachment_paths"][0], "rb") as f:
+                assert f.read() == report
+            assert emails[0]["attachment_details"][0]["filename"] == "report.pdf"
+            assert "attachment_paths" not in emails[1]
+            assert connection.commands == [("FETCH", "5", "(UID BODYSTRUCTURE)")] + [
+                ("FETCH", "5", f"(UID BODY.PEEK[2]<{offset}.20000>)")
+                for offset in range(0, len(report_encoded), 20000)
+            ]
+            store.close()
+        
+        print("\n✅ Attachment store tests passed!")
+        return True
+        
+    except Exception as e:
+        print(f"\n❌ Attachment store test failed: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_email_threading():
+    """Test grouping emails into conversations"""
+    print("\nTesting Email Threading...")
+    
+    try:
+        from email_threading import build_threads
+        
+        emails = [
+            {"id": "1", "subject": "Plan", "from": "Ann <ann@example.com>", "to": "bob@example.com",
+             "date": datetime(2024, 1, 1), "message_id": "<a@x>", "references": []},
+            {"id": "3", "subject": "Re: Plan", "from": "ann@example.com", "to": "bob@example.com",
+             "date": datetime(2024, 1, 3), "message_id": "<c@x>", "in_reply_to": "<b@x>",
+             "references": ["<a@x>", "<b@x>"]},
+            {"id": "2", "subject": "Re: Plan", "from": "bob@example.com", "to": "ann@example.com",
+             "date": datetime(2024, 1, 2), "message_id": "<b@x>", "in_reply_to": "<a@x>",
+             "references": ["<a@x>"]},
+            {"id": "4", "subject": "Other", "from": "carl@example.com", "to": "ann@example.com",
+             "date": datetime(2024, 1, 4), "message_id": "<d@x>", "references": []},
+            {"id": "5", "subject": "RE: other", "from": "ann@example.com", "to": "carl@example.com",
+             "date": datetime(2024, 1, 5), "message_id": "<e@x>", "in_reply_to": "<missing@x>"}
+        ]
+        
+        print("  ✓ Testing References/In-Reply-To linking...")
+        threads = build_threads(emails)
+        assert len(threads) == 2
+        plan = threads[1]
+        assert [m["id"] for m in plan["messages"]] == ["1", "2", "3"]
+        assert plan["participants"] == ["Ann <ann@example.com>", "bob@example.com"]
+        assert plan["last_date"] == datetime(2024, 1, 3)
+        
+        print("  ✓ Testing subject merge of orphaned replies...")
+        assert [m["id"] for m in threads[0]["messages"]] == ["4", "5"]
+        
+        print("\n✅ Email threading tests passed!")
+        return True
+        
+    except Exception as e:
+        print(f"\n❌ Email threading test failed: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_email_dedup():
+    """Test dropping duplicate messages across folders"""
+    print("\nTesting Email Deduplication...")
+    
+    try:
+        from email_dedup import EmailDeduplicator, deduplicate
+        
+        inbox = [
+            {"id": "1", "folder": "INBOX", "message_id": "<a@x>", "subject": "Hello"},
+            {"id": "2", "folder": "INBOX", "subject": "No ID", "from": "Ann <ann@example.com>",
+             "date": datetime(2024, 1, 1), "body": "Same  text"}
+        ]
+        all_mail = [
+            {"id": "7", "folder": "All Mail", "message_id": "<a@x>", "subject": "Hello"},
+            {"id": "8", "folder": "All Mail", "subject": "no id", "from": "ann <ann@example.com>",
+             "date": datetime(2024, 1, 1), "body": "Same text\n"},
+            {"id": "9", "folder": "All Mail", "message_id": "<b@x>", "subject": "Hello"}
+        ]
+        
+        print("  ✓ Testing Message-ID and content hash matching...")
+        emails = deduplicate(inbox + all_mail)
+        assert [(e["folder"], e["id"]) for e in emails] == [("INBOX", "1"), ("INBOX", "2"), ("All Mail", "9")]
+        
+        print("  ✓ Testing a deduplicator shared across fetches...")
+        deduplicator = EmailDeduplicator()
+        assert len(list(deduplicator.filter(inbox))) == 2
+        assert len(list(deduplicator.filter(all_mail))) == 1
+        assert deduplicator.duplicates == 2
+        
+        print("\n✅ Email deduplication tests passed!")
+        return True
+        
+    except Exception as e:
+        print(f"\n❌ Email deduplication test failed: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
 def cleanup_test_files():
     """Clean up test files"""
     print("\nCleaning up test files...")
     test_files = [
         "test_basic_export.xlsx",
         "test_summary_export.xlsx",
-        "test_export.csv"
+        "test_export.csv",
+        "test_stream_export.xlsx",
+        "test_stream_export.csv"
     ]
     
     for file in test_files:
@@ -176,6 +1500,25 @@ def main():
     
     results.append(("Email Processor Structure", test_email_processor_structure()))
     results.append(("Data Processing", test_data_processing()))
+    results.append(("HTML to Text", test_html_to_text()))
+    results.append(("IMAP Response Parsing", test_imap_response_parsing()))
+    results.append(("Search and Count", test_search_and_count()))
+    results.append(("Connection Pool", test_connection_pool()))
+    results.append(("Async IMAP", test_async_imap()))
+    results.append(("Partial Body Decoding", test_partial_body_decoding()))
+    results.append(("IMAP Compression", test_imap_compression()))
+    results.append(("Partitioned Fetch", test_partitioned_fetch()))
+    results.append(("Parallel Parsing", test_parallel_parsing()))
+    results.append(("Raw Message Store", test_raw_message_store()))
+    results.append(("Email Cache", test_email_cache()))
+    results.append(("Cache Resync", test_cache_resync()))
+    results.append(("New Email Watching", test_watch_new_emails()))
+    results.append(("Attachment Store", test_attachment_store()))
+    results.append(("Gmail Batch Fetch", test_gmail_batch_fetch()))
+    results.append(("Gmail Pagination", test_gmail_pagination()))
+    results.append(("Gmail Metadata Mode", test_gmail_metadata_mode()))
+    results.append(("Email Threading", test_email_threading()))
+    results.append(("Email Deduplication", test_email_dedup()))
     results.append(("Excel Exporter", test_excel_exporter()))
     
     print("\n" + "=" * 60)